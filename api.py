@@ -0,0 +1,234 @@
+from flask import Blueprint, Response, abort, request
+from werkzeug.exceptions import HTTPException
+from flask_login import current_user
+
+import csv
+import io
+import json
+
+try:  # 可选依赖：装了 orjson 时 JSON 接口用它序列化
+    import orjson
+except ImportError:
+    orjson = None
+from sqlalchemy import delete as sql_delete, select
+
+from models import db, Movie, Actor, Box, Relationship, Recommendation, _chunks, existing_ids, upsert_rows
+from queries import (PAGE_SIZE, keyset_page, release_date_filters, facet_selection, facet_filters, facet_counts,
+                     validate_movie, similar_movies)
+from graph import GRAPH_MAX_HOPS, costar_graph
+
+
+# JSON 接口
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+API_RESOURCES = {'movies': Movie, 'actors': Actor, 'boxes': Box, 'relationships': Relationship}
+MAX_BATCH_IDS = 1000  # ?ids= 一次最多查询的 id 个数
+
+
+def api_response(payload, status=200):
+    if orjson is not None:
+        body = orjson.dumps(payload)
+    else:
+        body = json.dumps(payload, ensure_ascii=False, separators=(',', ':'), default=str)
+    return Response(body, status=status, mimetype='application/json')
+
+
+def api_error(message, status):
+    return api_response({'error': message}, status)
+
+
+def _api_model(resource):
+    model = API_RESOURCES.get(resource)
+    if model is None:
+        abort(404)
+    return model
+
+
+def _api_columns(model):
+    # ?fields=title,year 只 SELECT 这些列，id 总是返回
+    columns = model.__table__.columns
+    fields = request.args.get('fields')
+    if not fields:
+        return list(columns)
+    names = ['id'] + [name for name in fields.split(',') if name and name != 'id']
+    unknown = [name for name in names if name not in columns]
+    if unknown:
+        abort(400, 'unknown fields: ' + ', '.join(unknown))
+    return [columns[name] for name in names]
+
+
+def _parse_ids(value):
+    try:
+        ids = [int(i) for i in value.split(',') if i.strip()]
+    except ValueError:
+        abort(400, 'ids must be integers')
+    if len(ids) > MAX_BATCH_IDS:
+        abort(400, f'at most {MAX_BATCH_IDS} ids per request')
+    return ids
+
+
+@api.errorhandler(400)
+@api.errorhandler(401)
+@api.errorhandler(404)  # 要按状态码注册，否则会被应用级的 404 页面抢先处理
+@api.errorhandler(HTTPException)
+def api_http_error(e):
+    return api_error(e.description if e.code == 400 else e.name.lower(), e.code)
+
+
+@api.route('/<resource>')
+def api_list(resource):
+    model = _api_model(resource)
+    columns = _api_columns(model)
+    query = db.session.query(*columns)
+    if model is Movie:
+        query = query.filter(*facet_filters(facet_selection()), *release_date_filters())
+    if 'ids' in request.args:
+        # 批量按 id 取：一条 IN 查询
+        ids = _parse_ids(request.args['ids'])
+        rows = query.filter(model.id.in_(ids)).order_by(model.id).all() if ids else []
+        return api_response({'items': [row._asdict() for row in rows]})
+    page = keyset_page(query, model.id)
+    return api_response({'items': [row._asdict() for row in page.items],
+                         'prev': page.prev_url, 'next': page.next_url})
+
+
+@api.route('/<resource>/<int:item_id>')
+def api_detail(resource, item_id):
+    model = _api_model(resource)
+    row = db.session.query(*_api_columns(model)).filter(model.id == item_id).first()
+    if row is None:
+        abort(404)
+    return api_response(row._asdict())
+
+
+MOVIE_FIELDS = ('id', 'title', 'year', 'country', 'type')
+MAX_BATCH_ROWS = 50000  # 批量接口一次最多处理的行数
+
+
+def _batch_operations():
+    # 返回 [(op, row)]；JSON 格式为 {"upserts": [{...}], "deletes": [id, ...]}，
+    # CSV 格式为带表头的 id,title,year,country,type，可选的 op 列取值 upsert / delete
+    if request.mimetype == 'text/csv':
+        reader = csv.DictReader(io.StringIO(request.get_data(as_text=True)))
+        return [((row.pop('op', None) or 'upsert').strip(), row) for row in reader]
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        abort(400, 'expected a JSON object or a text/csv body')
+    for name in ('upserts', 'deletes'):
+        if not isinstance(payload.get(name) or [], list):
+            abort(400, f'{name} must be a list')
+    operations = [('upsert', row if isinstance(row, dict) else {}) for row in payload.get('upserts') or []]
+    operations += [('delete', {'id': movie_id}) for movie_id in payload.get('deletes') or []]
+    return operations
+
+
+def _movie_id(value):
+    # 只接受整数（bool 除外）或十进制数字字符串，int() 会把 true、1.9 悄悄变成 1
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.strip().isascii() and value.strip().isdigit():
+        return int(value)
+    return None
+
+
+@api.route('/movies/batch', methods=['POST'])
+def api_movies_batch():
+    # 在一个事务里批量新增/更新/删除电影，逐行返回结果；不合法的行跳过，不影响其它行
+    # 同一批里先执行所有 upsert，再执行 delete
+    if not current_user.is_authenticated:
+        abort(401)
+    operations = _batch_operations()
+    if len(operations) > MAX_BATCH_ROWS:
+        abort(400, f'at most {MAX_BATCH_ROWS} rows per request')
+
+    results = []
+    upserts, deletes = {}, {}  # id -> 对应的结果
+    for index, (op, row) in enumerate(operations):
+        result = {'row': index, 'op': op}
+        results.append(result)
+        movie_id = _movie_id(row.get('id'))
+        if movie_id is None:
+            result.update(status='error', error='id must be an integer')
+            continue
+        result['id'] = movie_id
+        if op == 'delete':
+            deletes.setdefault(movie_id, []).append(result)
+        elif op == 'upsert':
+            values = {name: row.get(name) or None for name in MOVIE_FIELDS}
+            values['id'] = movie_id
+            # JSON 里的 "year": 2019 这类非字符串值不做猜测，按行报错
+            wrong = [name for name in MOVIE_FIELDS[1:] if not isinstance(values[name], (str, type(None)))]
+            error = f'{wrong[0]} must be a string' if wrong else validate_movie(values['title'], values['year'])
+            if error:
+                result.update(status='error', error=error)
+                continue
+            if movie_id in upserts:  # 同一个 id 出现多次时以最后一次为准
+                upserts[movie_id][0]['status'] = 'superseded'
+            upserts[movie_id] = (result, values)
+        else:
+            result.update(status='error', error='op must be upsert or delete')
+
+    existing = existing_ids(Movie, set(upserts) | set(deletes))
+    for movie_id, (result, _) in upserts.items():
+        result['status'] = 'updated' if movie_id in existing else 'created'
+    for movie_id, delete_results in deletes.items():
+        found = movie_id in existing or movie_id in upserts
+        for result in delete_results:
+            result['status'] = 'deleted' if found else 'not_found'
+
+    upsert_rows(Movie, [values for _, values in upserts.values()])
+    for chunk in _chunks(deletes):
+        db.session.execute(sql_delete(Movie).where(Movie.id.in_(chunk)))
+    db.session.commit()
+
+    summary = {}
+    for result in results:
+        summary[result['status']] = summary.get(result['status'], 0) + 1
+    return api_response({'summary': summary, 'results': results})
+
+
+def _graph_actor(actor_id):
+    if db.session.get(Actor, actor_id) is None:
+        abort(404)
+    return actor_id
+
+
+@api.route('/actors/<int:actor_id>/path/<int:other_id>')
+def api_actor_path(actor_id, other_id):
+    # 两个演员之间的最短合作路径，例如 吴京 -> 战狼2 -> 某演员 -> 流浪地球 -> ...
+    max_hops = max(1, min(request.args.get('max_hops', GRAPH_MAX_HOPS, type=int), GRAPH_MAX_HOPS))
+    path = costar_graph.get().shortest_path(_graph_actor(actor_id), _graph_actor(other_id), max_hops)
+    if path is None:
+        return api_error(f'no path within {max_hops} hops', 404)
+    actors = dict(db.session.execute(select(Actor.id, Actor.name).where(Actor.id.in_(path[::2]))).all())
+    movies = dict(db.session.execute(select(Movie.id, Movie.title).where(Movie.id.in_(path[1::2]))).all())
+    items = [{'type': 'actor', 'id': node, 'name': actors.get(node)} if i % 2 == 0 else
+             {'type': 'movie', 'id': node, 'title': movies.get(node)} for i, node in enumerate(path)]
+    return api_response({'hops': len(path) // 2, 'path': items})
+
+
+@api.route('/actors/<int:actor_id>/costars')
+def api_actor_costars(actor_id):
+    # ?hops=2 返回 2 跳以内的合作者，每一跳给出总数和前 limit 个 id
+    hops = max(1, min(request.args.get('hops', 1, type=int), 3))
+    limit = max(1, min(request.args.get('limit', PAGE_SIZE, type=int), MAX_BATCH_IDS))
+    levels = costar_graph.get().neighbourhood(_graph_actor(actor_id), hops)
+    return api_response({'id': actor_id, 'hops': [
+        {'hop': hop, 'count': len(level), 'ids': sorted(level)[:limit]} for hop, level in enumerate(levels, 1)]})
+
+
+@api.route('/movies/facets')
+def api_movie_facets():
+    selection = facet_selection()
+    return api_response({name: [{'value': value, 'count': count} for value, count in values]
+                         for name, values in facet_counts(selection).items()})
+
+
+@api.route('/movies/<int:movie_id>/similar')
+def api_similar_movies(movie_id):
+    row = db.session.query(Movie.id, Recommendation.similar).outerjoin(Recommendation, Recommendation.id == Movie.id) \
+        .filter(Movie.id == movie_id).first()
+    if row is None:
+        abort(404)
+    return api_response({'id': movie_id, 'items': [{'id': movie.id, 'title': movie.title}
+                                                   for movie in similar_movies(row.similar)]})
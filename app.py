@@ -1,12 +1,43 @@
-from flask import Flask, render_template, request, redirect, url_for
-from flask_sqlalchemy import SQLAlchemy
-from werkzeug.security import generate_password_hash, check_password_hash
-from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
-
+from flask import Flask, render_template, request, redirect, url_for, abort, g, has_request_context, Response, make_response
+from flask import before_render_template, template_rendered, stream_with_context
+from flask_login import LoginManager, login_user, login_required, logout_user, current_user
+
+import bisect
+import csv
+import functools
+import hashlib
+import io
+import json
 import os
+import random
+import sqlite3
 import sys
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from datetime import timezone
+
 import click
 
+from sqlalchemy import bindparam, column, event, func, insert, or_, select
+from sqlalchemy import table as sql_table, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import joinedload, make_transient_to_detached
+from sqlalchemy.schema import CreateTable
+
+from models import (db, User, Movie, Actor, Box, Relationship, TableVersion, Recommendation, recommendation_dirty,
+                    MovieFacet, parse_box_office, PINYIN_COLUMNS, pinyin_forms, DERIVED_COLUMNS,
+                    with_derived_columns, fill_derived_columns, SEARCH_INDEXES, SEARCH_WEIGHTS, SEARCH_LIMIT,
+                    RELATIONSHIP_COUNTS, _relationship_count_ddl, _recount_sql, _recommendation_dirty_ddl,
+                    _movie_facet_ddl, _movie_facet_rebuild_sql, derived_data_suspended, on_commit, _utcnow,
+                    _mark_changed, existing_ids, upsert_rows)
+from queries import (MAX_PAGE_SIZE, keyset_page, release_date_filters, facet_selection, facet_filters, facet_counts,
+                     _facet_url, validate_movie, similar_movies)
+from suggest import SUGGEST_LIMIT, SUGGEST_SOURCES, suggest_index
+from api import api, api_response
+
 from flask import Flask
 
 WIN = sys.platform.startswith('win')
@@ -17,66 +48,345 @@ else:  # 否则使用四个斜线
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'dev')
-app.config['SQLALCHEMY_DATABASE_URI'] = prefix + os.path.join(app.root_path, 'data.db')
+app.config['SQLALCHEMY_DATABASE_URI'] = prefix + os.path.join(app.root_path, os.getenv('DATABASE_FILE', 'data.db'))
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False  # 关闭对模型修改的监控
-# 在扩展类实例化前加载配置
-db = SQLAlchemy(app)
+
+# 数据库配置档：default 保持 SQLite 的默认设置，production 用于多个 gunicorn worker 的部署
+# 通过环境变量 DATABASE_PROFILE=production 启用
+DATABASE_PROFILES = {
+    'default': {
+        'pragmas': {
+            'foreign_keys': 'ON',  # SQLite 默认不检查外键
+        },
+        'engine_options': {},
+    },
+    'production': {
+        'pragmas': {
+            'foreign_keys': 'ON',
+            'busy_timeout': 5000,  # 遇到写锁时最多等待 5 秒，而不是立刻报 database is locked
+            'journal_mode': 'WAL',  # 写操作不再阻塞读操作
+            'synchronous': 'NORMAL',  # WAL 模式下 NORMAL 已能保证数据库不损坏
+            'mmap_size': 268435456,  # 256MB 内存映射读
+            'cache_size': -65536,  # 负数单位为 KiB，即每个连接 64MB 页缓存
+            'temp_store': 'MEMORY',
+        },
+        'engine_options': {
+            'pool_size': 10,
+            'max_overflow': 10,
+            'pool_pre_ping': True,
+        },
+    },
+}
+app.config['DATABASE_PROFILE'] = os.getenv('DATABASE_PROFILE', 'default')
+_profile = DATABASE_PROFILES[app.config['DATABASE_PROFILE']]
+app.config['SQLITE_PRAGMAS'] = dict(_profile['pragmas'])  # 每个新连接上执行的 PRAGMA，可单独覆盖
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = dict(_profile['engine_options'])
+# 请求级别的 SQL 次数和耗时统计，默认关闭，设置环境变量 METRICS=1 开启
+app.config['METRICS'] = os.getenv('METRICS', '0') == '1'
+# 在绑定扩展前加载配置；模型定义在 models.py
+db.init_app(app)
 
 login_manager = LoginManager(app)  # 实例化扩展类
 
 login_manager.login_view = 'login'
+app.register_blueprint(api)  # JSON 接口，定义在 api.py
 
 
-class User(db.Model, UserMixin):
-    id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(20))
-    username = db.Column(db.String(20))  # 用户名
-    password_hash = db.Column(db.String(128))  # 密码散列值
-
-    def set_password(self, password):  # 用来设置密码的方法，接受密码作为参数
-        self.password_hash = generate_password_hash(password)  # 将生成的密码保持到对应字段
-
-    def validate_password(self, password):  # 用于验证密码的方法，接受密码作为参数
-        return check_password_hash(self.password_hash, password)  # 返回布尔值
-
-
-class Movie(db.Model):  # 表名将会是 movie
-    id = db.Column(db.Integer, primary_key=True)  # 主键
-    title = db.Column(db.String(60))  # 电影标题
-    year = db.Column(db.String(20))  # 电影年份
-    country = db.Column(db.String(20))
-    type = db.Column(db.String(10))
-
-
-class Actor(db.Model):
-    id = db.Column(db.Integer, primary_key=True)  # 主键
-    name = db.Column(db.String(60))  # 演员标题
-    gender = db.Column(db.String(4))  # 性别
-    country = db.Column(db.String(20))
-
-
-class Box(db.Model):
-    id = db.Column(db.Integer, primary_key=True)  # 主键
-    box2 = db.Column(db.String(60))
-
-
-class Relationship(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    id1 = db.Column(db.Integer)
-    id2 = db.Column(db.Integer)
-    type = db.Column(db.String(10))
+@event.listens_for(Engine, 'connect')
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    # 连接池每建立一个新连接就应用一次 SQLITE_PRAGMAS
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    for name, value in app.config['SQLITE_PRAGMAS'].items():
+        cursor.execute(f'PRAGMA {name} = {value}')
+    cursor.close()
+
+
+# 直方图的桶上界；耗时单位为秒
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # 最后一个桶是 +Inf
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+# endpoint -> 各项指标的直方图；统计只在本进程内累计，多 worker 部署时每个进程分别暴露
+_metrics = {}
+_metrics_lock = threading.Lock()
+METRIC_SERIES = {
+    'watchlist_request_duration_seconds': ('total', LATENCY_BUCKETS),
+    'watchlist_sql_duration_seconds': ('sql_time', LATENCY_BUCKETS),
+    'watchlist_sql_queries': ('queries', QUERY_COUNT_BUCKETS),
+    'watchlist_template_render_seconds': ('render_time', LATENCY_BUCKETS),
+}
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if app.config['METRICS'] and has_request_context():
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if app.config['METRICS'] and has_request_context() and conn.info.get('query_start'):
+        elapsed = time.perf_counter() - conn.info['query_start'].pop()
+        if 'metrics' in g:  # test_request_context() 等场景不会执行 start_metrics
+            g.metrics['sql_time'] += elapsed
+            g.metrics['queries'] += 1
+
+
+def _before_render(sender, template, context, **extra):
+    if app.config['METRICS'] and has_request_context():
+        g.metrics_render_start = time.perf_counter()
+
+
+def _after_render(sender, template, context, **extra):
+    if app.config['METRICS'] and has_request_context() and 'metrics_render_start' in g:
+        elapsed = time.perf_counter() - g.pop('metrics_render_start')
+        if 'metrics' in g:
+            g.metrics['render_time'] += elapsed
+
+
+before_render_template.connect(_before_render, app)
+template_rendered.connect(_after_render, app)
+
+
+@app.before_request
+def start_metrics():
+    if app.config['METRICS']:
+        g.metrics = {'start': time.perf_counter(), 'queries': 0, 'sql_time': 0.0, 'render_time': 0.0}
+
+
+@app.after_request
+def record_metrics(response):
+    if not app.config['METRICS'] or 'metrics' not in g:
+        return response
+    m = g.metrics
+    m['total'] = time.perf_counter() - m['start']
+    response.headers['Server-Timing'] = (
+        f'db;dur={m["sql_time"] * 1000:.2f};desc="{m["queries"]} queries", '
+        f'render;dur={m["render_time"] * 1000:.2f}, total;dur={m["total"] * 1000:.2f}')
+    endpoint = request.endpoint or 'unknown'
+    with _metrics_lock:
+        series = _metrics.get(endpoint)
+        if series is None:
+            series = _metrics[endpoint] = {name: Histogram(buckets) for name, (_, buckets) in METRIC_SERIES.items()}
+        for name, (key, _) in METRIC_SERIES.items():
+            series[name].observe(m[key])
+    return response
+
+
+@app.route('/metrics')
+def metrics():
+    # Prometheus 文本格式的聚合指标
+    if not app.config['METRICS']:
+        return render_template('404.html'), 404
+    lines = []
+    with _metrics_lock:
+        for name in METRIC_SERIES:
+            lines.append(f'# TYPE {name} histogram')
+            for endpoint, series in sorted(_metrics.items()):
+                histogram = series[name]
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + ('+Inf',), histogram.counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{endpoint="{endpoint}",le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_sum{{endpoint="{endpoint}"}} {histogram.sum}')
+                lines.append(f'{name}_count{{endpoint="{endpoint}"}} {histogram.count}')
+    return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
+
+def search(model, fts, keyword, *criteria):
+    # 按关键字搜索，结果按 bm25 相关度排序；找不到时依次尝试拼音匹配和容错匹配
+    # criteria 为额外的过滤条件（如上映日期范围），在 SQL 里和关键字一起过滤
+    keyword = (keyword or '').strip()
+    if not keyword:
+        return model.query.filter(*criteria).order_by(model.id).limit(SEARCH_LIMIT).all()
+    table, columns = SEARCH_INDEXES[fts]
+    if len(keyword) >= 3 and db.engine.dialect.name == 'sqlite':
+        phrase = '"%s"' % keyword.replace('"', '""')  # 作为短语匹配，避免用户输入被解析成 FTS 语法
+        weights = ', '.join(str(w) for w in SEARCH_WEIGHTS[fts])
+        index = sql_table(fts, column('rowid'))
+        statement = select(model).join(index, model.id == index.c.rowid) \
+            .where(text(f'{fts} MATCH :q').bindparams(q=phrase), *criteria) \
+            .order_by(text(f'bm25({fts}, {weights})')).limit(SEARCH_LIMIT)
+        results = db.session.execute(statement).scalars().all()
+    else:
+        # trigram 至少需要 3 个字符，更短的关键字（如“八佰”）退化为 LIKE 子串匹配
+        pattern = '%' + keyword.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        conditions = [getattr(model, c).like(pattern, escape='\\') for c in columns]
+        results = model.query.filter(or_(*conditions), *criteria).order_by(model.id).limit(SEARCH_LIMIT).all()
+    return results or pinyin_search(model, keyword, SEARCH_LIMIT, *criteria) \
+        or fuzzy_search(model, keyword, SEARCH_LIMIT, *criteria)
+
+
+def _prefix_range(column, prefix):
+    # 前缀匹配写成范围条件，直接走列上的索引（SQLite 的 LIKE 默认不区分大小写，用不上普通索引）
+    return (column >= prefix) & (column < prefix[:-1] + chr(ord(prefix[-1]) + 1))
+
+
+def pinyin_search(model, keyword, limit, *criteria):
+    # '流浪di球'、'liulangdiqiu' 按全拼前缀匹配，纯字母的 'lldq' 还按首字母前缀匹配
+    _, full, initials = PINYIN_COLUMNS[model.__tablename__]
+    full_value, _ = pinyin_forms(keyword)
+    if not full_value:
+        return []
+    results = model.query.filter(_prefix_range(getattr(model, full), full_value), *criteria) \
+        .order_by(getattr(model, full)).limit(limit).all()
+    if len(results) < limit and keyword.isascii() and keyword.isalpha():
+        seen = {item.id for item in results}
+        column = getattr(model, initials)
+        more = model.query.filter(_prefix_range(column, keyword.lower()), *criteria).order_by(column).limit(limit)
+        results += [item for item in more if item.id not in seen]
+    return results[:limit]
+
+
+def fuzzy_search(model, keyword, limit, *criteria):
+    # 允许输错一两个字：在联想词索引里做 q-gram 过滤和有界编辑距离验证，再按主键取出
+    ids = [entry_id for entry_id, _ in suggest_index.get().fuzzy(model.__tablename__, keyword, limit)]
+    items = {item.id: item for item in model.query.filter(model.id.in_(ids), *criteria)} if ids else {}
+    return [items[i] for i in ids if i in items]
+
+
+# 进程内的用户缓存：键为用户 id，None 键对应 User.query.first() 查到的站点主人
+# 缓存的是列值快照而不是 ORM 对象本身，取用时合并进当前会话，不会再发 SELECT
+# 条目记下 user 表的版本号，其它进程（另一个 worker、flask admin）改过用户后版本号变化，重新查询
+# 密码散列不进缓存；需要时访问 password_hash 会现查数据库
+_user_cache = {}  # 键 -> (user 表版本号, 列值或 None)
+_USER_CACHE_COLUMNS = [column.key for column in User.__table__.columns if column.key != 'password_hash']
+
+
+def get_user(user_id=None):
+    key = None if user_id is None else int(user_id)
+    version = db.session.query(TableVersion.version).filter(TableVersion.name == 'user').scalar()
+    cached = _user_cache.get(key)
+    if cached is None or cached[0] != version:
+        # 会话里可能已有旧的对象，populate_existing 用查到的行覆盖它
+        user = User.query.populate_existing().first() if key is None else \
+            db.session.get(User, key, populate_existing=True)
+        _user_cache[key] = (version, None if user is None else {name: getattr(user, name)
+                                                                 for name in _USER_CACHE_COLUMNS})
+        return user
+    values = cached[1]
+    if values is None:
+        return None
+    user = User(**values)
+    make_transient_to_detached(user)
+    return db.session.merge(user, load=False)
+
+
+def invalidate_user_cache():
+    # 本进程修改用户数据后调用；提交时版本号已经变了，这里只是立即释放旧条目
+    _user_cache.clear()
 
 
 @app.context_processor
 def inject_user():  # 函数名可以随意修改
-    user = User.query.first()
+    user = get_user()
     return dict(user=user)  # 需要返回字典，等同于return {'user': user}
 
 
+# 批量造数用的素材
+FAKE_TITLE_WORDS = ['战狼', '流浪', '地球', '复仇者', '联盟', '红海', '行动', '唐人街', '探案', '机长',
+                    '长津湖', '姜子牙', '家乡', '捉妖记', '速度', '激情', '首富', '药神', '八佰', '哪吒']
+FAKE_SURNAMES = '王李张刘陈杨黄赵吴周徐孙马朱胡郭何高林罗'
+FAKE_GIVEN_NAMES = '京涛伟芳娜敏静丽强磊军洋勇艳杰娟涛明超秀霞平刚桂英华'
+FAKE_COUNTRIES = ['中国', '美国', '日本', '韩国', '英国', '法国']
+FAKE_TYPES = ['战争', '动画', '科幻', '喜剧', '剧情', '动作', '爱情', '悬疑']
+
+
+def _next_id(model):
+    return (db.session.query(func.max(model.id)).scalar() or 0) + 1
+
+
+def _batched(rows, batch_size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def seed_bulk(count, batch_size=10000, seed=0):
+    # 生成 count 部电影及相应比例的演员（1/2）、票房（1:1）和演职员关系（每部 3~5 条）
+    # 用 INSERT 批量写入，整个过程只有一个事务；返回各表写入的行数
+    rng = random.Random(seed)
+    actor_count = max(1, count // 2)
+    first_movie, first_actor, first_rel = _next_id(Movie), _next_id(Actor), _next_id(Relationship)
+    inserted = {'movie': 0, 'actor': 0, 'box': 0, 'relationship': 0}
+
+    def actors():
+        for actor_id in range(first_actor, first_actor + actor_count):
+            yield {'id': actor_id,
+                   'name': rng.choice(FAKE_SURNAMES) + ''.join(rng.choices(FAKE_GIVEN_NAMES, k=rng.randint(1, 2))),
+                   'gender': rng.choice('男女'), 'country': rng.choice(FAKE_COUNTRIES)}
+
+    def movies():
+        for movie_id in range(first_movie, first_movie + count):
+            yield {'id': movie_id,
+                   'title': ''.join(rng.sample(FAKE_TITLE_WORDS, 2)) + str(movie_id),
+                   'year': f'{rng.randint(1990, 2023)}/{rng.randint(1, 12)}/{rng.randint(1, 28)}',
+                   'country': rng.choice(FAKE_COUNTRIES), 'type': rng.choice(FAKE_TYPES)}
+
+    execute = db.session.connection().exec_driver_sql
+    with derived_data_suspended(execute):
+        for batch in _batched(actors(), batch_size):
+            db.session.execute(insert(Actor), with_derived_columns('actor', batch))
+            inserted['actor'] += len(batch)
+
+        rel_id = first_rel
+        for batch in _batched(movies(), batch_size):
+            db.session.execute(insert(Movie), with_derived_columns('movie', batch))
+            db.session.execute(insert(Box), [{'id': m['id'], 'box2': round(rng.uniform(0.1, 60), 2)} for m in batch])
+            relationships = []
+            for m in batch:
+                for i in range(rng.randint(3, 5)):
+                    relationships.append({'id': rel_id, 'id1': m['id'],
+                                          'id2': rng.randrange(first_actor, first_actor + actor_count),
+                                          'type': '导演' if i == 0 else '主演'})
+                    rel_id += 1
+            db.session.execute(insert(Relationship), relationships)
+            inserted['movie'] += len(batch)
+            inserted['box'] += len(batch)
+            inserted['relationship'] += len(relationships)
+
+    if User.query.first() is None:
+        db.session.add(User(name='Admin'))
+    db.session.commit()
+    invalidate_user_cache()
+    return inserted
+
+
 @app.cli.command()  # 注册为命令
-def forge():
+@click.option('--count', default=0, help='Bulk-generate this many synthetic movies instead of the sample data.')
+@click.option('--batch-size', default=10000, help='Rows per INSERT batch in bulk mode.')
+def forge(count, batch_size):
     """Generate fake data."""
     db.create_all()
+    if count > 0:
+        start = time.perf_counter()
+        inserted = seed_bulk(count, batch_size)
+        elapsed = time.perf_counter() - start
+        total = sum(inserted.values())
+        for table, rows in inserted.items():
+            click.echo(f'{table}: {rows} rows')
+        click.echo(f'Inserted {total} rows in {elapsed:.2f}s ({total / elapsed:.0f} rows/sec).')
+        return
     # 全局的两个变量移动到这个函数内
     name = 'TTYY751'
     movies = [
@@ -226,13 +536,14 @@ def forge():
         actor1 = Actor(id=int(a['id']), name=a['name'], gender=a['gender'], country=a['country'])
         db.session.add(actor1)
     for b in boxes:
-        box1 = Box(id=int(b['id']), box2=b['box2'])
+        box1 = Box(id=int(b['id']), box2=parse_box_office(b['box2']))
         db.session.add(box1)
     for r in relationships:
         relationship1 = Relationship(id=int(r['id']), id1=int(r['id1']), id2=int(r['id2']),type=r['type'])
         db.session.add(relationship1)
 
     db.session.commit()
+    invalidate_user_cache()
     click.echo('Done.')
 
 
@@ -247,10 +558,547 @@ def initdb(drop):
     click.echo('Initialized database.')  # 输出提示信息
 
 
+# 旧版 data.db 的升级步骤，由 flask upgradedb 按顺序执行
+# 每一步都必须可以重复执行：检查当前结构，已是最新就返回 False
+MIGRATIONS = []
+
+
+def migration(func):
+    MIGRATIONS.append(func)
+    return func
+
+
+@migration
+def relationship_foreign_keys(connection):
+    # SQLite 不能用 ALTER TABLE 添加外键，只能按官方推荐的步骤重建表：建新表、复制、删旧表、改名
+    if connection.exec_driver_sql('PRAGMA foreign_key_list(relationship)').first() is not None:
+        return False
+    # create_all 已经建好的触发器里引用了 relationship（包括 movie 上的 recommendation_dirty_movie_au），
+    # 表不存在的那一刻改名会因为这些触发器失败；先删掉，由后面的 relationship_counts、recommendation_triggers 重建
+    triggers = connection.exec_driver_sql(
+        "SELECT name FROM sqlite_master WHERE type = 'trigger' AND sql LIKE '%relationship%'").scalars().all()
+    for name in triggers:
+        connection.exec_driver_sql(f'DROP TRIGGER "{name}"')
+    create = str(CreateTable(Relationship.__table__).compile(connection))
+    connection.exec_driver_sql(create.replace('CREATE TABLE relationship ', 'CREATE TABLE relationship_new ', 1))
+    connection.exec_driver_sql(
+        'INSERT INTO relationship_new (id, id1, id2, type) SELECT id, id1, id2, type FROM relationship')
+    connection.exec_driver_sql('DROP TABLE relationship')
+    connection.exec_driver_sql('ALTER TABLE relationship_new RENAME TO relationship')
+    return True
+
+
+@migration
+def relationship_indexes(connection):
+    indexes = [index for index in Relationship.__table__.indexes
+               if connection.exec_driver_sql(
+                   "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?", (index.name,)).first() is None]
+    for index in indexes:
+        index.create(connection)
+    return bool(indexes)
+
+
+@migration
+def box_numeric(connection):
+    # 票房原来存成 VARCHAR，按文本排序和求和都不对；改为数值列并逐行解析回填
+    columns = {row[1]: row[2] for row in connection.exec_driver_sql('PRAGMA table_info(box)')}
+    if not columns.get('box2', '').upper().startswith('VARCHAR'):
+        return False
+    connection.exec_driver_sql('ALTER TABLE box RENAME TO box_old')
+    Box.__table__.create(connection)
+    rows = connection.exec_driver_sql('SELECT id, box2 FROM box_old').fetchall()
+    if rows:
+        connection.execute(Box.__table__.insert(), [{'id': id_, 'box2': parse_box_office(box2)} for id_, box2 in rows])
+    connection.exec_driver_sql('DROP TABLE box_old')
+    return True
+
+
+@migration
+def relationship_counts(connection):
+    # 给 movie / actor 加上计数列，建好触发器后统计一次
+    applied = False
+    for table, (column, _, _) in RELATIONSHIP_COUNTS.items():
+        if column not in {row[1] for row in connection.exec_driver_sql(f'PRAGMA table_info({table})')}:
+            connection.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {column} INTEGER NOT NULL DEFAULT '0'")
+            applied = True
+    # 重建 relationship 表（见 relationship_foreign_keys）时触发器会随旧表一起删除
+    if connection.exec_driver_sql(
+            "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'relationship_count_ai'").first() is None:
+        applied = True
+    if not applied:
+        return False
+    for statement in _relationship_count_ddl() + _recount_sql():
+        connection.exec_driver_sql(statement)
+    return True
+
+
+def _add_columns(connection, model, names):
+    # 用 ALTER TABLE 补上缺少的列及这些列上的索引；返回是否有改动
+    table = model.__tablename__
+    existing = {row[1] for row in connection.exec_driver_sql(f'PRAGMA table_info({table})')}
+    applied = False
+    for name in names:
+        if name not in existing:
+            column = model.__table__.c[name]
+            column_type = column.type.compile(connection.dialect)
+            connection.exec_driver_sql(f'ALTER TABLE {table} ADD COLUMN {name} {column_type}')
+            applied = True
+    for index in model.__table__.indexes:
+        if set(index.columns.keys()) & set(names) and connection.exec_driver_sql(
+                "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?", (index.name,)).first() is None:
+            index.create(connection)
+            applied = True
+    return applied
+
+
+@migration
+def recommendation_triggers(connection):
+    # 重建 relationship 表时删掉的推荐触发器；期间的改动没有被标记，所有电影都标记为需要重算
+    if connection.exec_driver_sql(
+            "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'recommendation_dirty_ai'").first():
+        return False
+    for statement in _recommendation_dirty_ddl():
+        connection.exec_driver_sql(statement)
+    connection.exec_driver_sql('INSERT OR IGNORE INTO recommendation_dirty (id) SELECT id FROM movie')
+    return True
+
+
+@migration
+def pinyin_columns(connection):
+    # 给标题和演员名加上拼音列及索引，装了 pypinyin 时顺便回填
+    applied = [_add_columns(connection, model, PINYIN_COLUMNS[model.__tablename__][1:]) for model in (Movie, Actor)]
+    if any(applied):
+        fill_derived_columns(connection.connection.driver_connection, sources={'title', 'name'})
+    return any(applied)
+
+
+@migration
+def release_dates(connection):
+    # 把 year 里五花八门的写法解析成可以按范围查询和排序的日期、年份列
+    if not _add_columns(connection, Movie, ('release_date', 'release_year')):
+        return False
+    fill_derived_columns(connection.connection.driver_connection, sources={'year'})
+    return True
+
+
+@migration
+def movie_facets(connection):
+    # 分面筛选用到的索引和汇总触发器；新库由 create_all 建好，这里补给升级上来的老库
+    applied = _add_columns(connection, Movie, ('country', 'type'))
+    # 早先建出的单列 country 索引是 ix_movie_country_type_id 的前缀，多余，删掉
+    if connection.exec_driver_sql(
+            "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'ix_movie_country'").first() is not None:
+        connection.exec_driver_sql('DROP INDEX ix_movie_country')
+        applied = True
+    if connection.exec_driver_sql(
+            "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'movie_facet_ai'").first() is None:
+        for statement in _movie_facet_ddl() + _movie_facet_rebuild_sql():
+            connection.exec_driver_sql(statement)
+        applied = True
+    return applied
+
+
+@app.cli.command()
+def upgradedb():
+    """Upgrade an existing database to the current schema."""
+    db.create_all()  # 先建出新增的表
+    with db.engine.connect() as connection:
+        # 重建表期间必须关闭外键检查，且 PRAGMA foreign_keys 在事务内无效
+        connection.exec_driver_sql('PRAGMA foreign_keys = OFF')
+        connection.exec_driver_sql('BEGIN')
+        for step in MIGRATIONS:
+            if step(connection):
+                click.echo(f'Applied {step.__name__}.')
+        orphans = connection.exec_driver_sql('PRAGMA foreign_key_check').fetchall()
+        connection.commit()
+        connection.exec_driver_sql('PRAGMA foreign_keys = ON')
+    if orphans:
+        tables = sorted({row[0] for row in orphans})
+        click.echo(f'Warning: {len(orphans)} rows reference missing records in {", ".join(tables)}.')
+    click.echo('Done.')
+
+
+@app.cli.command()
+def reindex():
+    """Rebuild the full-text search indexes, relationship counts, derived columns and facet counts."""
+    db.create_all()  # 老的 data.db 里还没有全文索引时先建出来
+    for fts in SEARCH_INDEXES:
+        db.session.execute(text(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')"))
+    for statement in _recount_sql():
+        db.session.execute(text(statement))
+    fill_derived_columns(db.session.connection().connection.driver_connection, only_missing=False)
+    for statement in _movie_facet_rebuild_sql():
+        db.session.execute(text(statement))
+    # text() 语句不经过变更跟踪，手动登记改过的表：递增版本号，提交后让缓存失效
+    for table in dict.fromkeys([*RELATIONSHIP_COUNTS, *DERIVED_COLUMNS, MovieFacet.__tablename__]):
+        _mark_changed(db.session, table, None)
+    db.session.commit()
+    click.echo('Done.')
+
+
+RECOMMENDATION_SIZE = 10  # 每部电影推荐几部
+# 得分：每个共同的导演 3 分、其他共同演职员 2 分，类型相同再加 1 分、国家相同加 0.5 分
+SIMILARITY_WEIGHTS = {'director': 3.0, 'cast': 2.0, 'type': 1.0, 'country': 0.5}
+
+
+def compute_recommendations(movie_ids, size=RECOMMENDATION_SIZE):
+    # 一条 SQL 算出这批电影的候选、得分和前 size 名；返回 {电影 id: [相似电影 id, ...]}
+    # 候选只来自有共同演职员的电影，走 relationship 上的两个索引
+    statement = text('''
+        SELECT movie, other FROM (
+            SELECT movie, other, row_number() OVER (PARTITION BY movie ORDER BY score DESC, other) AS rank FROM (
+                SELECT own.id1 AS movie, other.id1 AS other,
+                       sum(CASE WHEN own.type = '导演' AND other.type = '导演' THEN :director ELSE :cast END)
+                       + coalesce(max(m1.type = m2.type), 0) * :type
+                       + coalesce(max(m1.country = m2.country), 0) * :country AS score
+                FROM relationship AS own
+                JOIN relationship AS other ON other.id2 = own.id2 AND other.id1 != own.id1
+                JOIN movie AS m1 ON m1.id = own.id1
+                JOIN movie AS m2 ON m2.id = other.id1
+                WHERE own.id1 IN :ids
+                GROUP BY own.id1, other.id1))
+        WHERE rank <= :size ORDER BY movie, rank''').bindparams(bindparam('ids', expanding=True))
+    result = {movie_id: [] for movie_id in movie_ids}
+    for movie_id, other in db.session.execute(statement, dict(SIMILARITY_WEIGHTS, ids=list(movie_ids), size=size)):
+        result[movie_id].append(other)
+    return result
+
+
+@app.cli.command()
+@click.option('--full', is_flag=True, help='Recompute every movie instead of only the changed ones.')
+@click.option('--batch-size', default=500, help='Movies per transaction.')
+def recommend(full, batch_size):
+    """Precompute similar movies."""
+    db.create_all()
+    source = Movie.__table__ if full else recommendation_dirty
+    movie_ids = db.session.execute(select(source.c.id).order_by(source.c.id)).scalars().all()
+    count = 0
+    start = time.perf_counter()
+    for batch in _batched(movie_ids, batch_size):
+        # 先删标记拿到写锁，计算期间别的写入进不来，新标记不会被误删
+        db.session.execute(recommendation_dirty.delete().where(recommendation_dirty.c.id.in_(batch)))
+        existing = existing_ids(Movie, batch)
+        similar = compute_recommendations(sorted(existing))
+        now = _utcnow()
+        upsert_rows(Recommendation, [{'id': movie_id, 'similar': ','.join(map(str, others)), 'updated_at': now}
+                                     for movie_id, others in similar.items()])
+        db.session.commit()
+        count += len(batch)
+        click.echo(f'{count}/{len(movie_ids)} movies ({count / (time.perf_counter() - start):.0f}/sec)...')
+    click.echo(f'Updated recommendations for {count} movies in {time.perf_counter() - start:.2f}s.')
+
+
+def split_sql_statements(buffer):
+    # 在缓冲区里找出所有完整的语句，返回 (语句列表, 剩余的不完整部分)
+    # 由 sqlite3.complete_statement 判断边界，字符串和注释里的分号不会被误切
+    statements = []
+    start = 0
+    pos = buffer.find(';')
+    while pos != -1:
+        candidate = buffer[start:pos + 1]
+        if sqlite3.complete_statement(candidate):
+            if candidate.strip(' \t\r\n;'):
+                statements.append(candidate)
+            start = pos + 1
+        pos = buffer.find(';', pos + 1)
+    return statements, buffer[start:]
+
+
+def iter_sql_statements(file):
+    # 逐行读取 SQL 文件，内存占用只与单条语句的长度有关
+    buffer = ''
+    for line in file:
+        buffer += line
+        if ';' in line:
+            statements, buffer = split_sql_statements(buffer)
+            yield from statements
+    if buffer.strip():
+        yield buffer
+
+
+def _database_path():
+    return db.engine.url.database
+
+
+@app.cli.command()
+@click.argument('sql_file', type=click.Path(exists=True, dir_okay=False))
+@click.option('--database', type=click.Path(dir_okay=False), help='Target SQLite file, defaults to the app database.')
+@click.option('--batch-size', default=50000, help='Statements per transaction.')
+@click.option('--encoding', default='utf-8', help='Encoding of the SQL file.')
+def importsql(sql_file, database, batch_size, encoding):
+    """Stream a SQL dump into a SQLite database."""
+    path = database or _database_path()
+    connection = sqlite3.connect(path, isolation_level=None)  # 事务由下面手动控制
+    # 导入期间不等待落盘；中途断电需要重新导入
+    connection.execute('PRAGMA synchronous = OFF')
+    connection.execute('PRAGMA foreign_keys = OFF')
+    # 先删掉二级索引，全部写完后再统一重建，比边插入边维护 B 树快得多
+    indexes = connection.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL").fetchall()
+    for name, _ in indexes:
+        connection.execute(f'DROP INDEX "{name}"')
+
+    count = 0
+    start = time.perf_counter()
+    try:
+        with derived_data_suspended(connection.execute), open(sql_file, encoding=encoding) as file:
+            try:
+                connection.execute('BEGIN')
+                for statement in iter_sql_statements(file):
+                    try:
+                        connection.execute(statement)
+                    except sqlite3.Error as e:
+                        raise click.ClickException(
+                            f'Statement {count + 1} failed: {e}\n{statement.strip()[:200]}\n'
+                            f'The first {count // batch_size * batch_size} statements were committed.')
+                    count += 1
+                    if count % batch_size == 0:
+                        connection.execute('COMMIT')
+                        click.echo(f'{count} statements ({count / (time.perf_counter() - start):.0f}/sec)...')
+                        connection.execute('BEGIN')
+                connection.execute('COMMIT')
+            except BaseException:
+                # 放弃还没提交的这一批，退出 with 时在自动提交模式下恢复触发器
+                if connection.in_transaction:
+                    connection.execute('ROLLBACK')
+                raise
+    finally:
+        for name, sql in indexes:
+            try:
+                connection.execute(sql.replace('CREATE INDEX', 'CREATE INDEX IF NOT EXISTS', 1))
+            except sqlite3.OperationalError as e:  # 索引所在的表被 SQL 文件删掉了
+                click.echo(f'Skipped index {name}: {e}')
+        try:  # SQL 文件绕过了 ORM，写入的行没有拼音和上映日期，补上
+            connection.execute('BEGIN')
+            fill_derived_columns(connection)
+            connection.execute('COMMIT')
+        except sqlite3.OperationalError as e:  # 表被删掉了，或者是没有派生列的旧结构
+            connection.execute('ROLLBACK')
+            click.echo(f'Skipped derived columns: {e}')
+        connection.execute('ANALYZE')
+        # SQL 文件绕过了 ORM，把所有表的版本号都递增一次，让缓存的 ETag 失效
+        # 刚 initdb 的库里还没有版本号记录，UPDATE 改不到任何行，必须逐表插入或递增
+        if connection.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'table_version'").fetchone():
+            updated_at = _utcnow().isoformat(sep=' ')
+            connection.executemany(
+                'INSERT INTO table_version (name, version, updated_at) VALUES (?, 1, ?) '
+                'ON CONFLICT(name) DO UPDATE SET version = version + 1, updated_at = excluded.updated_at',
+                [(table, updated_at) for table in db.metadata.tables if table != TableVersion.__tablename__])
+        connection.close()
+    elapsed = time.perf_counter() - start
+    click.echo(f'Executed {count} statements in {elapsed:.2f}s ({count / elapsed:.0f}/sec).')
+
+
+EXPORT_FORMATS = ('csv', 'jsonl')
+
+
+def format_rows(columns, rows, fmt, header=False):
+    # 把一批行转成 CSV 或 JSON Lines 文本
+    buffer = io.StringIO()
+    if fmt == 'csv':
+        writer = csv.writer(buffer, lineterminator='\n')
+        if header:
+            writer.writerow(columns)
+        writer.writerows(rows)
+    else:
+        for row in rows:
+            buffer.write(json.dumps(dict(zip(columns, row)), ensure_ascii=False, default=str))
+            buffer.write('\n')
+    return buffer.getvalue()
+
+
+def iter_export(cursor, fmt, batch_size):
+    # 用 fetchmany 分批取行，任何时刻内存里最多只有 batch_size 行
+    columns = [d[0] for d in cursor.description]
+    if fmt == 'csv':
+        yield format_rows(columns, [], fmt, header=True)
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        yield format_rows(columns, rows, fmt)
+
+
+@app.cli.command()
+@click.option('--table', required=True, help='Table to export.')
+@click.option('--where', help='Optional SQL condition, e.g. "id1 = 1001".')
+@click.option('--format', 'fmt', type=click.Choice(EXPORT_FORMATS), default='csv', help='Output format.')
+@click.option('--output', '-o', default='-', help='Output file, defaults to stdout.')
+@click.option('--database', type=click.Path(exists=True, dir_okay=False),
+              help='Source SQLite file, defaults to the app database.')
+@click.option('--batch-size', default=5000, help='Rows fetched per round trip.')
+def export(table, where, fmt, output, database, batch_size):
+    """Export a table as CSV or JSON Lines."""
+    connection = sqlite3.connect(database or _database_path())
+    try:
+        exists = connection.execute(
+            "SELECT 1 FROM sqlite_master WHERE type IN ('table', 'view') AND name = ?", (table,)).fetchone()
+        if exists is None:
+            raise click.BadParameter(f'no such table: {table}', param_hint='--table')
+        sql = 'SELECT * FROM "%s"' % table
+        if where:
+            sql += ' WHERE ' + where
+        cursor = connection.execute(sql)
+        with click.open_file(output, 'w', encoding='utf-8') as file:
+            for chunk in iter_export(cursor, fmt, batch_size):
+                file.write(chunk)
+    finally:
+        connection.close()
+
+
 from flask import request, url_for, redirect, flash
 
+# 渲染好的列表页缓存：键为 (endpoint, 是否登录, 查询参数)，有界 LRU + TTL
+# 本进程的写操作提交后按表和主键范围精确失效；其它 worker 的写入在取用时按表的版本号发现
+app.config.setdefault('PAGE_CACHE_SIZE', int(os.getenv('PAGE_CACHE_SIZE', 512)))  # 0 表示关闭
+app.config.setdefault('PAGE_CACHE_TTL', int(os.getenv('PAGE_CACHE_TTL', 60)))  # 秒
+
+
+class PageCache:
+    # 本进程的提交按 tags 精确失效；其它进程的写入靠版本号发现：
+    # 条目记下渲染时各表的版本号减去本进程已提交的次数，取用时对不上说明有别的进程写过，按未命中处理
+    def __init__(self):
+        self._entries = OrderedDict()  # key -> (过期时间, html, 依赖的表 {表名: (lo, hi) 或 None}, {表名: 版本号偏移})
+        self._lock = threading.Lock()
+        self._local_bumps = {}  # 表名 -> 本进程提交让版本号增加了多少
+        self.generation = 0  # 每次失效加一，渲染期间发生过失效的结果不写入缓存
+
+    def _offsets(self, versions):
+        return {table: version - self._local_bumps.get(table, 0) for table, version in versions.items()}
+
+    def get(self, key, versions):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic() or entry[3] != self._offsets(versions):
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, html, tags, generation, versions):
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._entries[key] = (time.monotonic() + app.config['PAGE_CACHE_TTL'], html, tags,
+                                  self._offsets(versions))
+            self._entries.move_to_end(key)
+            while len(self._entries) > app.config['PAGE_CACHE_SIZE']:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, changes):
+        with self._lock:
+            self.generation += 1
+            for table in changes:  # 每个事务里每张表的版本号只加一
+                self._local_bumps[table] = self._local_bumps.get(table, 0) + 1
+            stale = [key for key, (_, _, tags, _) in self._entries.items() if _page_affected(tags, changes)]
+            for key in stale:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+
+
+def _page_affected(tags, changes):
+    for table, ids in changes.items():
+        if table not in tags:
+            continue
+        bounds = tags[table]
+        if bounds is None or ids is None:
+            return True
+        lo, hi = bounds
+        if any((lo is None or i > lo) and (hi is None or i <= hi) for i in ids):
+            return True
+    return False
+
+
+page_cache = PageCache()
+on_commit(page_cache.invalidate)
+
+
+def table_versions(names):
+    # 各表的 (版本号, 更新时间)，没有记录的表为 (0, None)
+    # 外层的 conditional_get 已经查过时用它放在 g 里的结果（取出即删，不会留给之后的请求），不再重复查询
+    known = g.pop('table_versions', {})
+    if not all(name in known for name in names):
+        known = dict.fromkeys(names, (0, None))
+        known.update((name, (version, updated_at)) for name, version, updated_at in db.session.execute(
+            select(TableVersion.name, TableVersion.version, TableVersion.updated_at)
+            .where(TableVersion.name.in_(names))))
+    return {name: known[name] for name in names}
+
+
+def cached_page(*tables):
+    # 缓存 GET 请求渲染出的 HTML；tables 为页面依赖的表，站点主人的名字显示在每页上，所以总是依赖 user 表
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method != 'GET' or app.config['PAGE_CACHE_SIZE'] <= 0:
+                return view(*args, **kwargs)
+            key = (request.endpoint, current_user.is_authenticated, tuple(sorted(request.args.items(multi=True))))
+            names = tables + ('user',)
+            versions = {name: version for name, (version, _) in table_versions(names).items()}
+            html = page_cache.get(key, versions)
+            if html is not None:
+                return html
+            generation = page_cache.generation
+            g.pop('page_bounds', None)
+            response = view(*args, **kwargs)
+            if isinstance(response, str):
+                tags = dict.fromkeys(names)
+                if 'page_bounds' in g:
+                    table, lo, hi = g.page_bounds
+                    tags[table] = (lo, hi)
+                page_cache.set(key, response, tags, generation, versions)
+            return response
+        return wrapper
+    return decorator
+
+
+def conditional_get(*tables):
+    # 用相关表的版本号生成强 ETag；If-None-Match 命中时直接返回 304，不再执行列表查询和模板渲染
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method != 'GET':
+                return view(*args, **kwargs)
+            versions = table_versions(tables + ('user',))
+            state = (request.endpoint, sorted((request.view_args or {}).items()),
+                     sorted(request.args.items(multi=True)), current_user.get_id(),
+                     [(name, version) for name, (version, _) in sorted(versions.items()) if version])
+            etag = hashlib.sha1(repr(state).encode('utf-8')).hexdigest()
+            stamps = [updated_at for _, updated_at in versions.values() if updated_at is not None]
+            last_modified = max(stamps).replace(microsecond=0, tzinfo=timezone.utc) if stamps else None
+
+            if request.if_none_match:
+                not_modified = request.if_none_match.contains(etag)
+            else:
+                not_modified = (last_modified is not None and request.if_modified_since is not None
+                                and last_modified <= request.if_modified_since)
+            if not_modified:
+                response = Response(status=304)
+            else:
+                g.table_versions = versions  # 交给内层的 cached_page，两者用同一组版本号
+                try:
+                    response = make_response(view(*args, **kwargs))
+                finally:
+                    g.pop('table_versions', None)
+            response.set_etag(etag)
+            if last_modified is not None:
+                response.last_modified = last_modified
+            response.vary.add('Cookie')  # 登录与否看到的页面不同
+            return response
+        return wrapper
+    return decorator
+
 
 @app.route('/', methods=['GET', 'POST'])
+@conditional_get('movie', 'relationship')
+@cached_page('movie', 'relationship')  # 列表里的演职员人数随 relationship 变化
 def index():
     if request.method == 'POST':
         if not current_user.is_authenticated:  # 如果当前用户未认证
@@ -260,7 +1108,7 @@ def index():
         year = request.form.get('year')
         country = request.form.get('country')
         type1 = request.form.get('type')
-        if not title or not year or len(year) > 20 or len(title) > 60:
+        if validate_movie(title, year):
             flash('Invalid input.')  # 显示错误提示
             return redirect(url_for('index'))  # 重定向回主页
             # 保存表单数据到数据库
@@ -269,9 +1117,11 @@ def index():
         db.session.commit()  # 提交数据库会话
         flash('Item created.')  # 显示成功创建的提示
         return redirect(url_for('index'))  # 重定向回主页
-    user = User.query.first()
-    movies = Movie.query.all()
-    return render_template('index.html', user=user, movies=movies)
+    selection = facet_selection()
+    page = keyset_page(Movie.query.filter(*facet_filters(selection), *release_date_filters()), Movie.id)
+    g.pop('page_bounds', None)  # 页面上的分面计数随任何一部电影的增删改变化，缓存整页按表失效
+    return render_template('index.html', movies=page.items, page=page, facets=facet_counts(selection),
+                           selection=selection, facet_url=_facet_url)
 
 
 @app.route('/movie/edit/<int:movie_id>', methods=['GET', 'POST'])
@@ -287,7 +1137,7 @@ def edit(movie_id):
         country = request.form.get('country')
         type1 = request.form.get('type')
         # 验证数据
-        if not title or not year or len(year) > 20 or len(title) > 60:
+        if validate_movie(title, year):
             flash('Invalid input.')  # 显示错误提示
             return redirect(url_for('edit', movie_id=movie_id))  # 重定向回主页
         # 更新已存在的电影对象
@@ -313,6 +1163,18 @@ def delete(movie_id):
     return redirect(url_for('index'))  # 重定向回主页
 
 
+@app.route('/movie/<int:movie_id>')
+@conditional_get('movie', 'actor', 'relationship', 'recommendation')
+def movie_detail(movie_id):
+    # 电影和它的推荐列表一起按主键取出
+    row = db.session.query(Movie, Recommendation.similar).outerjoin(Recommendation, Recommendation.id == Movie.id) \
+        .filter(Movie.id == movie_id).first_or_404()
+    # 演职员表：一次 JOIN，relationship 上的 (id1, type) 索引直接定位到这部电影的行
+    credits = db.session.query(Relationship.type, Actor).join(Actor, Actor.id == Relationship.id2) \
+        .filter(Relationship.id1 == movie_id).order_by(Relationship.type.desc(), Actor.id).all()
+    return render_template('movie_detail.html', movie=row.Movie, credits=credits, similar=similar_movies(row.similar))
+
+
 @app.errorhandler(404)  # 传入要处理的错误代码
 def page_not_found(e):  # 接受异常对象作为参数
     return render_template('404.html'), 404  # 返回模板和状态码
@@ -337,12 +1199,13 @@ def admin(username, password):
         db.session.add(user)
 
     db.session.commit()  # 提交数据库会话
+    invalidate_user_cache()
     click.echo('Done.')
 
 
 @login_manager.user_loader
 def load_user(user_id):  # 创建用户加载回调函数，接受用户 ID 作为参数
-    user = User.query.get(int(user_id))  # 用 ID 作为 User 模型的主键查询对应的用户
+    user = get_user(user_id)  # 用 ID 作为 User 模型的主键查询对应的用户，命中缓存时不查库
     return user  # 返回用户对象
 
 
@@ -356,9 +1219,9 @@ def login():
             flash('Invalid input.')
             return redirect(url_for('login'))
 
-        user = User.query.first()
+        user = User.query.populate_existing().first()  # 不走 get_user 的缓存，始终用数据库里的最新密码验证
         # 验证用户名和密码是否一致
-        if username == user.username and user.validate_password(password):
+        if user is not None and username == user.username and user.validate_password(password):
             login_user(user)  # 登入用户
             flash('Login success.')
             return redirect(url_for('index'))  # 重定向到主页
@@ -393,78 +1256,238 @@ def settings():
         # user = User.query.first()
         # user.name = name
         db.session.commit()
+        invalidate_user_cache()
         flash('Settings updated.')
         return redirect(url_for('index'))
 
     return render_template('settings.html')
 
 
-@app.route('/search', methods=['POST'])
+@app.route('/search', methods=['GET', 'POST'])
+@conditional_get('movie')
 def search_movies():
-    movies = None
-    if request.method == 'POST':
-        # 获取用户输入的电影名
-        title = request.form.get('title')
+    # 获取用户输入的电影名；表单改用 GET 提交，结果可以被浏览器和 CDN 缓存
+    title = request.values.get('title')
 
-        # 创建查询基础
-        query = Movie.query
+    # 在全文索引中按片名、类型、国家做子串匹配，可以用 from / to 限定上映日期
+    movies = search(Movie, 'movie_fts', title, *release_date_filters())
 
-        # 在数据库中查询电影
-        if title:
-            query = query.filter_by(title=title)
-
-        # 执行查询
-        movies = query.all()
-
-        # 渲染模板并将查询结果传递给模板
-        return render_template('search.html', movies=movies)
-
-    # 如果是 GET 请求，直接渲染模板
-    return render_template('404.html')
+    # 渲染模板并将查询结果传递给模板
+    return render_template('search.html', movies=movies)
 
 
 @app.route('/actor', methods=['GET', 'POST'])
+@conditional_get('actor', 'relationship')
+@cached_page('actor', 'relationship')
 def actor():
     if request.method == 'POST':
         return render_template('actor.html')
-    actors = Actor.query.all()
-    return render_template('actor.html', actors=actors)
+    page = keyset_page(Actor.query, Actor.id)
+    return render_template('actor.html', actors=page.items, page=page)
 
 
-@app.route('/search2', methods=['POST'])
-def search_actors():
-    if request.method == 'POST':
-        # 获取用户输入的电影名
-        name = request.form.get('name')
+@app.route('/actor/<int:actor_id>')
+@conditional_get('movie', 'actor', 'relationship')
+def actor_detail(actor_id):
+    actor = Actor.query.get_or_404(actor_id)
+    # 作品表：一次 JOIN，走 relationship 上的 (id2, type) 索引
+    credits = db.session.query(Relationship.type, Movie).join(Movie, Movie.id == Relationship.id1) \
+        .filter(Relationship.id2 == actor_id) \
+        .order_by(Movie.release_year.desc(), Movie.release_date.desc(), Movie.id).all()
+    return render_template('actor_detail.html', actor=actor, credits=credits)
+
 
-        # 创建查询基础
-        query = Actor.query
+@app.route('/search2', methods=['GET', 'POST'])
+@conditional_get('actor')
+def search_actors():
+    # 获取用户输入的演员名
+    name = request.values.get('name')
 
-        # 在数据库中查询演员
-        if name:
-            query = query.filter_by(name=name)
+    # 在全文索引中按演员名做子串匹配
+    actors = search(Actor, 'actor_fts', name)
 
-        # 执行查询
-        actors = query.all()
+    # 渲染模板并将查询结果传递给模板
+    return render_template('search2.html', actors=actors)
 
-        # 渲染模板并将查询结果传递给模板
-        return render_template('search2.html', actors=actors)
 
-    # 如果是 GET 请求，直接渲染模板
-    return render_template('404.html')
+@app.route('/suggest')
+def suggest():
+    # 搜索框每次按键都会请求：除了读一次版本号，全部在内存里完成
+    q = (request.args.get('q') or '').strip()
+    limit = max(1, min(request.args.get('limit', SUGGEST_LIMIT, type=int), MAX_PAGE_SIZE))
+    result = {name: [] for _, name in SUGGEST_SOURCES.values()}
+    if q:
+        snapshot = suggest_index.get()
+        for table, (column, name) in SUGGEST_SOURCES.items():
+            result[name] = [{'id': entry_id, column: text} for entry_id, text in snapshot.suggest(table, q, limit)]
+    return api_response(result)
 
 
 @app.route('/box', methods=['GET', 'POST'])
+@conditional_get('box', 'movie')
+@cached_page('box', 'movie')
 def box():
     if request.method == 'POST':
         return render_template('box.html')
-    boxes = Box.query.all()
-    return render_template('box.html', boxes=boxes)
+    mode = request.args.get('mode')
+    if mode == 'top':
+        # 票房榜：走 box2 上的索引倒序取前 N 条
+        n = max(1, min(request.args.get('n', 10, type=int), MAX_PAGE_SIZE))
+        ranking = db.session.query(Box, Movie.title).outerjoin(Movie, Movie.id == Box.id) \
+            .order_by(Box.box2.desc()).limit(n).all()
+        return render_template('box.html', mode=mode, ranking=ranking)
+    if mode == 'stats':
+        # 分组汇总全部在 SQL 里完成
+        by = request.args.get('by', 'type')
+        keys = {'type': Movie.type, 'country': Movie.country, 'year': Movie.release_year}
+        if by not in keys:
+            by = 'type'
+        key = keys[by]
+        stats = db.session.query(key.label('key'), func.count(Box.id).label('count'),
+                                 func.sum(Box.box2).label('total'), func.avg(Box.box2).label('average')) \
+            .join(Movie, Movie.id == Box.id).group_by(key).order_by(func.sum(Box.box2).desc()).all()
+        return render_template('box.html', mode=mode, by=by, stats=stats)
+    page = keyset_page(Box.query, Box.id)
+    return render_template('box.html', boxes=page.items, page=page)
 
 
 @app.route('/relationship', methods=['GET', 'POST'])
+@conditional_get('relationship', 'movie', 'actor')
+@cached_page('relationship', 'movie', 'actor')
 def relationship():
     if request.method == 'POST':
         return render_template('relationship.html')
-    relationships = Relationship.query.all()
-    return render_template('relationship.html', relationships=relationships)
+    # 电影和演员在同一条 JOIN 查询里取出，渲染时不会再逐行懒加载
+    query = Relationship.query.options(joinedload(Relationship.movie), joinedload(Relationship.actor))
+    page = keyset_page(query, Relationship.id)
+    return render_template('relationship.html', relationships=page.items, page=page)
+
+
+EXPORT_TABLES = {'movie': Movie, 'actor': Actor, 'box': Box, 'relationship': Relationship}
+EXPORT_MIMETYPES = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+EXPORT_BATCH = 2000  # 每批从游标取出的行数
+
+
+def _gzip_stream(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 输出 gzip 格式
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+@app.route('/export/<table>.<fmt>')
+def export_table(table, fmt):
+    # 流式导出整张表：yield_per 分批取行，边查边写，内存占用与表大小无关
+    # ?since=<id> 只导出 id 更大的行，可作为增量导出的水位线；客户端接受 gzip 时边压缩边发送
+    model = EXPORT_TABLES.get(table)
+    if model is None or fmt not in EXPORT_FORMATS:
+        abort(404)
+    columns = list(model.__table__.columns)
+    names = [column.key for column in columns]
+    statement = select(*columns).order_by(model.id).execution_options(yield_per=EXPORT_BATCH)
+    since = request.args.get('since', type=int)
+    if since is not None:
+        statement = statement.where(model.id > since)
+
+    def generate():
+        if fmt == 'csv':
+            yield format_rows(names, [], fmt, header=True)
+        for rows in db.session.execute(statement).partitions():
+            yield format_rows(names, rows, fmt)
+
+    chunks = stream_with_context(generate())
+    compress = request.accept_encodings['gzip'] > 0
+    response = Response(_gzip_stream(chunks) if compress else chunks,
+                        mimetype=EXPORT_MIMETYPES[fmt], headers={'Vary': 'Accept-Encoding'})
+    if compress:
+        response.headers['Content-Encoding'] = 'gzip'
+    response.headers['Content-Disposition'] = f'attachment; filename={table}.{fmt}'
+    return response
+
+
+def _import_converter(column):
+    # CSV 里全是字符串，按列类型转换；空字符串当作 NULL
+    if column.key == 'box2':
+        convert = parse_box_office
+    elif isinstance(column.type, db.Integer):
+        convert = int
+    else:
+        convert = str
+    return lambda value: None if value is None or value == '' else convert(value)
+
+
+def iter_import_rows(file, fmt, model):
+    # 每列的转换函数只准备一次，逐行解析是导入的主要开销
+    # 计数列由触发器维护、拼音和上映日期由源列生成，导出文件里带的旧值直接丢弃
+    ignored = {RELATIONSHIP_COUNTS[model.__tablename__][0]} if model.__tablename__ in RELATIONSHIP_COUNTS else set()
+    ignored.update(target for _, targets, _ in DERIVED_COLUMNS.get(model.__tablename__, ()) for target in targets)
+    converters = {column.key: _import_converter(column)
+                  for column in model.__table__.columns if column.key not in ignored}
+    if fmt == 'csv':
+        rows = csv.DictReader(file)
+    else:
+        rows = (line for line in file if line.strip())
+    for number, row in enumerate(rows, 1):
+        try:
+            if fmt != 'csv':  # JSON 在这里解析，格式错误也按行报告
+                row = json.loads(row)
+                if not isinstance(row, dict):
+                    raise ValueError('expected a JSON object')
+            values = {name: converters[name](value) for name, value in row.items() if name not in ignored}
+        except KeyError:
+            unknown = [name for name in row if name not in converters and name not in ignored]
+            raise click.ClickException(f'Row {number}: unknown columns {", ".join(map(str, unknown))}')
+        except ValueError as e:  # 包括 json.JSONDecodeError
+            raise click.ClickException(f'Row {number}: {e}')
+        yield number, values
+
+
+@app.cli.command('import')
+@click.argument('table', type=click.Choice(sorted(EXPORT_TABLES)))
+@click.argument('data_file', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(EXPORT_FORMATS), help='Defaults to the file extension.')
+@click.option('--batch-size', default=20000, help='Rows per transaction.')
+def import_table(table, data_file, fmt, batch_size):
+    """Upsert rows from a CSV or JSON Lines file."""
+    model = EXPORT_TABLES[table]
+    fmt = fmt or ('jsonl' if data_file.endswith(('.jsonl', '.json')) else 'csv')
+    db.create_all()
+    count = rejected = 0
+    start = time.perf_counter()
+    # 和 seed_bulk、importsql 一样，导入期间暂停全文索引、计数、推荐和分面的触发器，结束时（包括失败时）一次性重建
+    # 每批提交后会话换了连接，所以每次都取当前的连接执行
+    execute = lambda *args: db.session.connection().exec_driver_sql(*args)  # noqa: E731
+    try:
+        with derived_data_suspended(execute), open(data_file, encoding='utf-8', newline='') as file:
+            for batch in _batched(iter_import_rows(file, fmt, model), batch_size):
+                rows = []
+                for number, row in batch:
+                    if row.get('id') is None or (model is Movie and validate_movie(row.get('title'), row.get('year'))):
+                        rejected += 1
+                        if rejected <= 10:
+                            click.echo(f'Skipped row {number}: '
+                                       f'{validate_movie(row.get("title"), row.get("year")) or "id is required"}')
+                        continue
+                    rows.append(row)
+                # executemany 要求每行的列相同，缺少的列补 NULL
+                names = list(dict.fromkeys(name for row in rows for name in row))
+                rows = [{name: row.get(name) for name in names} for row in rows]
+                try:
+                    upsert_rows(model, rows)
+                    db.session.commit()  # 每批一个事务
+                except DBAPIError as e:
+                    db.session.rollback()
+                    raise click.ClickException(f'Batch ending at row {batch[-1][0]} failed: {e.orig}\n'
+                                               f'{count} rows were imported before it.')
+                count += len(rows)
+                click.echo(f'{count} rows ({count / (time.perf_counter() - start):.0f} rows/sec)...')
+    finally:
+        # 恢复触发器和重建派生数据在最后这个事务里，重建过的表也要让缓存失效
+        for name in dict.fromkeys([*RELATIONSHIP_COUNTS, *DERIVED_COLUMNS, MovieFacet.__tablename__]):
+            _mark_changed(db.session, name, None)
+        db.session.commit()
+    elapsed = time.perf_counter() - start
+    click.echo(f'Imported {count} rows into {table} in {elapsed:.2f}s ({count / elapsed:.0f} rows/sec), '
+               f'skipped {rejected}.')
@@ -0,0 +1,234 @@
+"""Benchmark the routes in app.py.
+
+Seeds a database of the requested size (once), drives every route through
+the Flask test client from one or more threads and prints the results as
+JSON. Each route runs in its own process against a fresh copy of the seeded
+file, so the write routes never change the seed and every route starts from
+the same data and cold caches, e.g.:
+
+    python bench.py --movies 100000 --requests 500 --concurrency 4 -o bench.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import re
+import shutil
+import sys
+import threading
+import time
+
+try:
+    import resource  # Windows 上没有这个模块，此时不统计峰值内存
+except ImportError:
+    resource = None
+
+ROUTES = ['index', 'search_movies', 'search_actors', 'actor', 'box', 'relationship', 'edit', 'delete']
+BENCH_USERNAME = 'bench'
+BENCH_PASSWORD = 'bench'
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--movies', type=int, default=10000,
+                        help='movies to seed, e.g. 10000 / 100000 / 1000000 (default: 10000)')
+    parser.add_argument('--database', default='bench.db', help='SQLite file to seed and use (default: bench.db)')
+    parser.add_argument('--reseed', action='store_true', help='drop and seed the database even if it exists')
+    parser.add_argument('--requests', type=int, default=200, help='requests per route (default: 200)')
+    parser.add_argument('--concurrency', type=int, default=1, help='client threads per route (default: 1)')
+    parser.add_argument('--routes', default=','.join(ROUTES), help='comma separated routes to run')
+    parser.add_argument('--seed', type=int, default=0, help='random seed for the generated requests')
+    parser.add_argument('--output', '-o', help='write the JSON report here instead of stdout')
+    return parser.parse_args()
+
+
+def percentile(sorted_values, p):
+    # 最近秩法
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, round(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def peak_rss_bytes():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024  # Linux 上单位是 KiB
+
+
+def seed(app_module, movies, reseed):
+    app, db = app_module.app, app_module.db
+    with app.app_context():
+        if reseed:
+            db.drop_all()
+        db.create_all()
+        if app_module.Movie.query.first() is None:
+            start = time.perf_counter()
+            inserted = app_module.seed_bulk(movies)
+            print(f'Seeded {inserted} in {time.perf_counter() - start:.1f}s', file=sys.stderr)
+        user = app_module.User.query.first()
+        user.username = BENCH_USERNAME
+        user.set_password(BENCH_PASSWORD)
+        db.session.commit()
+        app_module.invalidate_user_cache()
+        db.session.execute(db.text('ANALYZE'))
+        db.session.commit()
+        bounds = db.session.query(db.func.min(app_module.Movie.id), db.func.max(app_module.Movie.id)).one()
+        rel_max = db.session.query(db.func.max(app_module.Relationship.id)).scalar() or 0
+        movie_count = app_module.Movie.query.count()
+    return {'movie_min': bounds[0], 'movie_max': bounds[1], 'relationship_max': rel_max, 'movies': movie_count}
+
+
+def make_requests(app_module, info, rng):
+    # 每个路由返回一个 fn(client) -> response，参数在可用范围内随机取
+    words = app_module.FAKE_TITLE_WORDS
+    names = app_module.FAKE_SURNAMES
+    lo, hi = info['movie_min'], info['movie_max']
+    delete_ids = iter(range(hi, lo - 1, -1))  # 从最大的 id 往下删，每次删不同的电影；main 保证请求数不超过电影数
+    delete_lock = threading.Lock()
+
+    def delete(client):
+        with delete_lock:
+            movie_id = next(delete_ids)
+        return client.post(f'/movie/delete/{movie_id}')
+
+    def edit(client):
+        movie_id = rng.randint(lo, lo + max(1, (hi - lo) // 2))
+        return client.post(f'/movie/edit/{movie_id}', data={
+            'id': movie_id, 'title': rng.choice(words) + str(movie_id), 'year': '2020/1/1',
+            'country': '中国', 'type': '剧情'})
+
+    return {
+        'index': lambda client: client.get(f'/?after={rng.randint(lo, hi)}'),
+        'search_movies': lambda client: client.post('/search', data={'title': rng.choice(words) + rng.choice(words)}),
+        'search_actors': lambda client: client.post('/search2', data={'name': rng.choice(names) + rng.choice(names)}),
+        'actor': lambda client: client.get('/actor'),
+        'box': lambda client: client.get('/box?mode=top'),
+        'relationship': lambda client: client.get(f'/relationship?after={rng.randint(0, info["relationship_max"])}'),
+        'edit': edit,
+        'delete': delete,
+    }
+
+
+def logged_in_client(app):
+    client = app.test_client()
+    client.post('/login', data={'username': BENCH_USERNAME, 'password': BENCH_PASSWORD})
+    return client
+
+
+def run_route(app, fn, total, concurrency):
+    latencies, queries, errors = [], [], [0]
+    lock = threading.Lock()
+    per_thread = [total // concurrency + (1 if i < total % concurrency else 0) for i in range(concurrency)]
+
+    def worker(count):
+        client = logged_in_client(app)
+        for _ in range(count):
+            start = time.perf_counter()
+            response = fn(client)
+            elapsed = time.perf_counter() - start
+            match = re.search(r'desc="(\d+) queries"', response.headers.get('Server-Timing', ''))
+            with lock:
+                latencies.append(elapsed)
+                if match:
+                    queries.append(int(match.group(1)))
+                if response.status_code >= 400:
+                    errors[0] += 1
+
+    threads = [threading.Thread(target=worker, args=(count,)) for count in per_thread]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': errors[0],
+        'requests_per_sec': round(len(latencies) / wall, 2) if wall else None,
+        'latency_ms': {name: round(percentile(latencies, p) * 1000, 3)
+                       for name, p in (('p50', 50), ('p95', 95), ('p99', 99))},
+        'mean_queries': round(sum(queries) / len(queries), 2) if queries else None,
+    }
+
+
+def seed_database(database, movies, reseed):
+    os.environ['DATABASE_FILE'] = os.path.abspath(database)  # 必须在导入 app 之前设置
+    import app as app_module
+
+    info = seed(app_module, movies, reseed)
+    with app_module.app.app_context():
+        app_module.db.engine.dispose()
+    return info
+
+
+def bench_route(database, route, info, args):
+    # 在子进程里运行：database 是种子库的一份副本，写操作只改副本
+    os.environ['DATABASE_FILE'] = database
+    import app as app_module
+
+    app_module.app.config['METRICS'] = True  # 借助 Server-Timing 头统计每个请求的 SQL 次数
+    # 关闭页面缓存：/actor、/box 这类不带参数的路由每次都命中缓存，测不到查询本身的耗时
+    app_module.app.config['PAGE_CACHE_SIZE'] = 0
+    requests = make_requests(app_module, info, random.Random(args.seed))
+    result = run_route(app_module.app, requests[route], args.requests, args.concurrency)
+    result['peak_rss_bytes'] = peak_rss_bytes()
+    return result
+
+
+def copy_database(source, target):
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(target + suffix):
+            os.remove(target + suffix)
+    shutil.copyfile(source, target)
+
+
+def main():
+    args = parse_args()
+    routes = args.routes.split(',')
+    for route in routes:
+        if route not in ROUTES:
+            sys.exit(f'unknown route: {route}')
+    # 种子库在子进程里建好，主进程不导入 app，也就不持有数据库连接
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(1) as pool:
+        info = pool.apply(seed_database, (args.database, args.movies, args.reseed))
+    if 'delete' in routes and args.requests > info['movies']:
+        sys.exit(f'--requests ({args.requests}) exceeds the {info["movies"]} seeded movies the delete route can remove')
+
+    results = {}
+    working = os.path.abspath(args.database) + '.run'
+    try:
+        for route in routes:
+            print(f'Running {route}...', file=sys.stderr)
+            copy_database(args.database, working)
+            with context.Pool(1) as pool:
+                results[route] = pool.apply(bench_route, (working, route, info, args))
+    finally:
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(working + suffix):
+                os.remove(working + suffix)
+
+    rss = [result['peak_rss_bytes'] for result in results.values() if result['peak_rss_bytes'] is not None]
+    report = {
+        'database': args.database,
+        'movies': info['movies'],
+        'requests_per_route': args.requests,
+        'concurrency': args.concurrency,
+        'routes': results,
+        'peak_rss_bytes': max(rss) if rss else None,
+    }
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            file.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
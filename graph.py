@@ -0,0 +1,164 @@
+import bisect
+from array import array
+
+from sqlalchemy import select
+
+from models import Relationship, on_commit, _chunks
+from snapshots import SnapshotIndex
+
+
+# 合作关系图：relationship 本身就是电影-演员二部图，常驻内存，供“几度人脉”和 k 跳邻居查询
+# 邻接表用 CSR 布局：ids 为排好序的节点 id，节点 ids[i] 的邻居是 targets[offsets[i]:offsets[i + 1]]
+# 全部是整数 array，百万条边只占几十 MB；建好后不再修改，之后的写入记在 patched 里覆盖对应节点
+GRAPH_MAX_HOPS = 6  # 最短路径最多经过几个演员间的“合作”
+GRAPH_MAX_VISITED = 200000  # 单次搜索最多访问的演员数，防止超级节点把查询拖慢
+GRAPH_MAX_PATCHED = 50000  # 增量覆盖的节点超过这个数就重建
+
+
+def _csr(pairs):
+    # pairs 为排好序的 (节点, 邻居)，重复的边只保留一条
+    ids, offsets, targets = array('q'), array('q'), array('q')
+    previous = None
+    for pair in pairs:
+        if pair == previous:
+            continue
+        node, target = previous = pair
+        if not ids or ids[-1] != node:
+            ids.append(node)
+            offsets.append(len(targets))
+        targets.append(target)
+    offsets.append(len(targets))
+    return ids, offsets, targets
+
+
+class GraphSnapshot:
+    def __init__(self, connection):
+        # 百万行的全表读取直接用 DBAPI 游标，省掉 SQLAlchemy 逐行构造 Row 的开销；任一端为 NULL 的行不构成边
+        cursor = connection.connection.cursor()
+        cursor.execute('SELECT id, id1, id2 FROM relationship WHERE id1 IS NOT NULL AND id2 IS NOT NULL ORDER BY id')
+        rows = cursor.fetchall()
+        cursor.close()
+        self.edge_ids = array('q', [row[0] for row in rows])
+        self.edge_movies = array('q', [row[1] for row in rows])
+        self.edge_actors = array('q', [row[2] for row in rows])
+        del rows
+        self.movies = _csr(sorted(zip(self.edge_movies, self.edge_actors)))  # 电影 -> 演员
+        self.actors = _csr(sorted(zip(self.edge_actors, self.edge_movies)))  # 演员 -> 电影
+        self.patched_movies, self.patched_actors = {}, {}  # 节点 id -> 最新的邻居元组
+        self.changed_edges = {}  # relationship id -> 最新的 (id1, id2)，已删除为 None
+
+    @staticmethod
+    def _neighbours(csr, patched, node):
+        if node in patched:
+            return patched[node]
+        ids, offsets, targets = csr
+        i = bisect.bisect_left(ids, node)
+        if i < len(ids) and ids[i] == node:
+            return targets[offsets[i]:offsets[i + 1]]
+        return ()
+
+    def films(self, actor_id):
+        return self._neighbours(self.actors, self.patched_actors, actor_id)
+
+    def cast(self, movie_id):
+        return self._neighbours(self.movies, self.patched_movies, movie_id)
+
+    def edge(self, edge_id):
+        if edge_id in self.changed_edges:
+            return self.changed_edges[edge_id]
+        i = bisect.bisect_left(self.edge_ids, edge_id)
+        if i < len(self.edge_ids) and self.edge_ids[i] == edge_id:
+            return self.edge_movies[i], self.edge_actors[i]
+        return None
+
+    def apply(self, session, pending):
+        # 本进程提交的改动：查出这些 relationship 的新值，受影响的电影和演员整行重新读取邻居
+        edge_ids = sorted(pending['relationship'])
+        current = dict.fromkeys(edge_ids)
+        for chunk in _chunks(edge_ids):
+            for edge_id, movie_id, actor_id in session.execute(
+                    select(Relationship.id, Relationship.id1, Relationship.id2).where(Relationship.id.in_(chunk))):
+                current[edge_id] = (movie_id, actor_id)
+        pairs = [pair for pair in [self.edge(edge_id) for edge_id in edge_ids] + list(current.values())
+                 if pair and None not in pair]
+        for patched, key, other, nodes in (
+                (self.patched_movies, Relationship.id1, Relationship.id2, {m for m, _ in pairs}),
+                (self.patched_actors, Relationship.id2, Relationship.id1, {a for _, a in pairs})):
+            neighbours = {node: [] for node in nodes}
+            for chunk in _chunks(nodes):
+                rows = session.execute(select(key, other).distinct().where(key.in_(chunk), other.isnot(None))
+                                       .order_by(key, other))
+                for node, target in rows:
+                    neighbours[node].append(target)
+            patched.update((node, tuple(targets)) for node, targets in neighbours.items())
+        self.changed_edges.update(current)
+
+    def patched_size(self):
+        return len(self.patched_movies) + len(self.patched_actors)
+
+    def _expand(self, frontier, visited):
+        # 向外扩展一层：演员 -> 电影 -> 合作过的演员；visited 记录每个演员的 (上一个演员, 经过的电影)
+        found = []
+        for actor_id in frontier:
+            for movie_id in self.films(actor_id):
+                for other in self.cast(movie_id):
+                    if other not in visited:
+                        visited[other] = (actor_id, movie_id)
+                        found.append(other)
+        return found
+
+    def shortest_path(self, source, target, max_hops=GRAPH_MAX_HOPS):
+        # 双向 BFS，每次扩展较小的一侧；返回 [演员, 电影, 演员, ..., 演员] 的 id 列表，找不到返回 None
+        if source == target:
+            return [source]
+        forward, backward = {source: None}, {target: None}
+        forward_frontier, backward_frontier = [source], [target]
+        for _ in range(max_hops):
+            if not forward_frontier or not backward_frontier:
+                return None
+            if len(forward_frontier) > len(backward_frontier):
+                forward, backward = backward, forward
+                forward_frontier, backward_frontier = backward_frontier, forward_frontier
+            forward_frontier = self._expand(forward_frontier, forward)
+            # 同一层里可能有多个交汇点，都是最短的，取第一个即可
+            meeting = next((actor_id for actor_id in forward_frontier if actor_id in backward), None)
+            if meeting is not None:
+                break
+            if len(forward) + len(backward) > GRAPH_MAX_VISITED:
+                return None
+        else:
+            return None
+        half = []
+        node = meeting
+        while node is not None:  # 从交汇点沿着 forward 往回走
+            half.append(node)
+            step = forward[node]
+            if step is not None:
+                half.append(step[1])
+                step = step[0]
+            node = step
+        path = half[::-1]
+        node = backward[meeting]
+        while node is not None:
+            path.extend((node[1], node[0]))
+            node = backward[node[0]]
+        if path[0] != source:
+            path.reverse()
+        return path
+
+    def neighbourhood(self, actor_id, hops):
+        # 返回每一跳新出现的演员 id 列表
+        visited = {actor_id: None}
+        frontier, levels = [actor_id], []
+        for _ in range(hops):
+            frontier = self._expand(frontier, visited)
+            if not frontier:
+                break
+            levels.append(frontier)
+            if len(visited) > GRAPH_MAX_VISITED:
+                break
+        return levels
+
+
+costar_graph = SnapshotIndex(GraphSnapshot, ('relationship',), max_patched=GRAPH_MAX_PATCHED)
+on_commit(costar_graph.invalidate)
@@ -0,0 +1,597 @@
+# 数据模型、派生数据（拼音、上映日期、全文索引、计数、推荐、分面）的维护和写入的变更跟踪
+# 不依赖 Flask 应用对象：app.py 里的 db.init_app(app) 再把它们绑定到应用上，其它模块都可以单独导入这里
+from flask_sqlalchemy import SQLAlchemy
+from werkzeug.security import generate_password_hash, check_password_hash
+from flask_login import UserMixin
+
+import calendar
+import re
+from contextlib import contextmanager
+from datetime import date, datetime, timezone
+
+try:  # 可选依赖：装了 pypinyin 才能按拼音搜索
+    from pypinyin import lazy_pinyin
+except ImportError:
+    lazy_pinyin = None
+from sqlalchemy import event, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+db = SQLAlchemy()
+
+
+class User(db.Model, UserMixin):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(20))
+    username = db.Column(db.String(20))  # 用户名
+    password_hash = db.Column(db.String(128))  # 密码散列值
+
+    def set_password(self, password):  # 用来设置密码的方法，接受密码作为参数
+        self.password_hash = generate_password_hash(password)  # 将生成的密码保持到对应字段
+
+    def validate_password(self, password):  # 用于验证密码的方法，接受密码作为参数
+        return check_password_hash(self.password_hash, password)  # 返回布尔值
+
+
+class Movie(db.Model):  # 表名将会是 movie
+    __table_args__ = (
+        # 按分面筛选的列表页：等值条件 + 按 id 翻页都在索引里完成；单列索引在 SQLite 里隐含 (列, id)
+        db.Index('ix_movie_country_type_id', 'country', 'type', 'id'),
+    )
+    id = db.Column(db.Integer, primary_key=True)  # 主键
+    title = db.Column(db.String(60))  # 电影标题
+    year = db.Column(db.String(20))  # 电影年份，原样保存用户输入的 '2017/7/27'、'2020/08/21' 等
+    country = db.Column(db.String(20))  # 按国家筛选用 ix_movie_country_type_id 的前缀
+    type = db.Column(db.String(10), index=True)
+    cast_count = db.Column(db.Integer, nullable=False, server_default='0')  # 演职员人数，由触发器维护
+    title_pinyin = db.Column(db.String(255), index=True)  # 标题全拼，如 liulangdiqiu，写入时计算
+    title_initials = db.Column(db.String(60), index=True)  # 标题拼音首字母，如 lldq
+    release_date = db.Column(db.Date, index=True)  # 由 year 解析出的上映日期，只有年份或无法解析时为空
+    release_year = db.Column(db.Integer, index=True)  # 由 year 解析出的年份
+
+
+class Actor(db.Model):
+    id = db.Column(db.Integer, primary_key=True)  # 主键
+    name = db.Column(db.String(60))  # 演员标题
+    gender = db.Column(db.String(4))  # 性别
+    country = db.Column(db.String(20))
+    film_count = db.Column(db.Integer, nullable=False, server_default='0')  # 参演作品数，由触发器维护
+    name_pinyin = db.Column(db.String(255), index=True)  # 姓名全拼
+    name_initials = db.Column(db.String(60), index=True)  # 姓名拼音首字母
+
+
+class Box(db.Model):
+    id = db.Column(db.Integer, primary_key=True)  # 主键，与电影 id 相同
+    box2 = db.Column(db.Numeric(12, 2, asdecimal=False), index=True)  # 票房，单位亿元
+
+
+def parse_box_office(value):
+    # 兼容旧数据里的 '56.84'、'56.84亿'、' 1,234.5 ' 等写法，无法解析时返回 None
+    if value is None or isinstance(value, (int, float)):
+        return value
+    value = str(value).strip().replace(',', '').replace('亿元', '').replace('亿', '')
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+# 兼容 '2017/7/27'、'2020-08-21'、'2020.8.21'、'2020年8月21日'、'2019/7'、'2019' 等写法
+# 年份前后不能紧挨数字：'20190101' 这类没有分隔符的写法不猜，解析不出
+RELEASE_DATE_PATTERN = re.compile(
+    r'(?<!\d)(\d{4})(?:\s*[-/.年]\s*(\d{1,2})(?:\s*[-/.月]\s*(\d{1,2})日?)?)?(?!\d)')
+
+
+def _release_date_parts(value, strict=False):
+    # 返回 (年, 月, 日)，缺少的部分为 None；年份不合理或完全无法解析时返回 None
+    # 用户输入的 year 里可能夹着别的文字，只找出日期部分；strict 时整个值必须就是一个日期
+    if value is None:
+        return None
+    match = (RELEASE_DATE_PATTERN.fullmatch if strict else RELEASE_DATE_PATTERN.search)(str(value).strip())
+    if match is None or not 1800 <= int(match.group(1)) <= 2200:
+        return None
+    return tuple(int(part) if part else None for part in match.groups())
+
+
+def parse_release_date(value):
+    # 返回 (上映日期, 年份)；只有年月、日期不存在（如 2019/2/30）时日期为 None
+    parts = _release_date_parts(value)
+    if parts is None:
+        return None, None
+    year, month, day = parts
+    try:
+        return (date(year, month, day) if day else None), year
+    except ValueError:
+        return None, year
+
+
+def release_date_bound(value, upper=False):
+    # ?from= / ?to= 的取值转成 (比较的列, 边界值)，无法解析时返回 None
+    # '2019' 比较 release_year（只填了年份的电影也算在内），'2019-07' 表示整月、'2019-07-01' 表示当天
+    parts = _release_date_parts(value, strict=True)
+    if parts is None:
+        return None
+    year, month, day = parts
+    if month is None:
+        return Movie.release_year, year
+    try:
+        first = date(year, month, day or 1)
+        last = date(year, month, day or calendar.monthrange(year, month)[1])
+    except ValueError:
+        return None
+    return Movie.release_date, last if upper else first
+
+
+class Relationship(db.Model):
+    __table_args__ = (
+        db.Index('ix_relationship_id1_type', 'id1', 'type'),  # 某部电影的演职员
+        db.Index('ix_relationship_id2_type', 'id2', 'type'),  # 某个演员的作品
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    id1 = db.Column(db.Integer, db.ForeignKey('movie.id', ondelete='CASCADE', onupdate='CASCADE'))  # 电影 id
+    id2 = db.Column(db.Integer, db.ForeignKey('actor.id', ondelete='CASCADE', onupdate='CASCADE'))  # 演员 id
+    type = db.Column(db.String(10))  # 主演 / 导演
+    # 删除或修改电影、演员的 id 时交给数据库的级联外键处理，ORM 不去加载关联行
+    movie = db.relationship('Movie', backref=db.backref('relationships', passive_deletes=True))
+    actor = db.relationship('Actor', backref=db.backref('relationships', passive_deletes=True))
+
+
+class TableVersion(db.Model):
+    # 每张表的写入版本号，写事务内递增；存在数据库里，多个 worker 进程看到的是同一个值
+    name = db.Column(db.String(40), primary_key=True)  # 表名
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime)  # 最后一次写入的 UTC 时间
+
+
+class Recommendation(db.Model):
+    # 每部电影预先算好的相似电影，由 flask recommend 生成；展示时只需一次主键读取
+    id = db.Column(db.Integer, db.ForeignKey('movie.id', ondelete='CASCADE', onupdate='CASCADE'), primary_key=True)
+    similar = db.Column(db.Text, nullable=False, default='')  # 按得分从高到低的电影 id，如 '1003,1017,1005'
+    updated_at = db.Column(db.DateTime)
+
+
+# 演职员或类型、国家变了、推荐需要重算的电影 id，由触发器写入，flask recommend 处理后删除
+recommendation_dirty = db.Table('recommendation_dirty', db.Column('id', db.Integer, primary_key=True))
+
+
+class MovieFacet(db.Model):
+    # 按 (国家, 类型, 上映年份) 汇总的电影数，由 movie 上的触发器增减；列表页的分面计数只读这张小表
+    # 主键列不能为空，电影的这几列为空时分别记作 '' 和 0
+    country = db.Column(db.String(20), primary_key=True)
+    type = db.Column(db.String(10), primary_key=True)
+    release_year = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+
+# 拼音列：{表名: (原文列, 全拼列, 首字母列)}
+PINYIN_COLUMNS = {
+    'movie': ('title', 'title_pinyin', 'title_initials'),
+    'actor': ('name', 'name_pinyin', 'name_initials'),
+}
+
+
+def pinyin_forms(text):
+    # '流浪地球' -> ('liulangdiqiu', 'lldq')；非汉字部分原样保留、转小写，空白和标点去掉
+    # 没装 pypinyin 时返回 (None, None)
+    if lazy_pinyin is None or not text:
+        return None, None
+    # 只调用一次 lazy_pinyin（批量写入时它是主要开销）：非汉字片段加上 \0 标记，首字母由音节首字母拼出
+    syllables = lazy_pinyin(text, errors=lambda segment: ['\0' + segment])
+    full = ''.join(syllable.lstrip('\0') for syllable in syllables)
+    initials = ''.join(syllable[1:] if syllable[0] == '\0' else syllable[0] for syllable in syllables)
+    full = ''.join(char for char in full.lower() if char.isalnum())
+    initials = ''.join(char for char in initials.lower() if char.isalnum())
+    return full or None, initials or None
+
+
+# 写入时由源列计算出的派生列：表名 -> [(源列, (派生列, ...), 计算函数)]
+# ORM 对象赋值时由属性事件计算，批量写入（seed_bulk、upsert_rows）调用 with_derived_columns，
+# 绕过这两者的写入（importsql、升级旧库）由 fill_derived_columns 补齐
+DERIVED_COLUMNS = {
+    'movie': [('title', ('title_pinyin', 'title_initials'), pinyin_forms),
+              ('year', ('release_date', 'release_year'), parse_release_date)],
+    'actor': [('name', ('name_pinyin', 'name_initials'), pinyin_forms)],
+}
+
+
+def with_derived_columns(table, rows):
+    # 给批量写入的行字典补上派生列；Core 语句不会触发下面的 ORM 属性事件
+    for source, targets, compute in DERIVED_COLUMNS.get(table, ()):
+        for row in rows:
+            if source in row:
+                row.update(zip(targets, compute(row[source])))
+    return rows
+
+
+def fill_derived_columns(connection, only_missing=True, sources=None, chunk_size=10000):
+    # connection 为 sqlite3 连接，sources 可以只选部分源列（如 {'title', 'name'}）；返回更新的行数
+    # 按主键分段读取和写回，内存占用和表的大小无关（importsql 导入的表可能有上千万行）
+    count = 0
+    for table, specs in DERIVED_COLUMNS.items():
+        for source, targets, compute in specs:
+            if sources is not None and source not in sources or compute is pinyin_forms and lazy_pinyin is None:
+                continue
+            where = f'{source} IS NOT NULL' + (f' AND {targets[0]} IS NULL' if only_missing else '')
+            assignments = ', '.join(f'{target} = ?' for target in targets)
+            last = None
+            while True:
+                # 派生值可能仍为 NULL（解析不出日期），用 id > 上一段末尾翻页，不会反复读到同一批
+                condition, params = (where, ()) if last is None else (f'{where} AND id > ?', (last,))
+                rows = connection.execute(f'SELECT id, {source} FROM {table} WHERE {condition} '
+                                          f'ORDER BY id LIMIT {chunk_size}', params).fetchall()
+                if not rows:
+                    break
+                # 直接用 sqlite3 写入，日期按 SQLAlchemy 的格式存成 ISO 字符串
+                connection.executemany(
+                    f'UPDATE {table} SET {assignments} WHERE id = ?',
+                    [tuple(value.isoformat() if isinstance(value, date) else value for value in compute(value))
+                     + (row_id,) for row_id, value in rows])
+                count += len(rows)
+                last = rows[-1][0]
+    return count
+
+
+@event.listens_for(Movie.title, 'set')
+def _movie_title_pinyin(target, value, oldvalue, initiator):
+    target.title_pinyin, target.title_initials = pinyin_forms(value)
+
+
+@event.listens_for(Movie.year, 'set')
+def _movie_release_date(target, value, oldvalue, initiator):
+    target.release_date, target.release_year = parse_release_date(value)
+
+
+@event.listens_for(Actor.name, 'set')
+def _actor_name_pinyin(target, value, oldvalue, initiator):
+    target.name_pinyin, target.name_initials = pinyin_forms(value)
+
+
+# 全文索引：FTS5 外部内容表 + 触发器同步，trigram 分词器对中文标题也能做任意子串匹配
+SEARCH_INDEXES = {
+    'movie_fts': ('movie', ['title', 'type', 'country']),
+    'actor_fts': ('actor', ['name']),
+}
+SEARCH_WEIGHTS = {'movie_fts': (10.0, 1.0, 1.0), 'actor_fts': (1.0,)}  # bm25 各列权重，标题最重要
+SEARCH_LIMIT = 50  # 搜索结果最多返回条数
+
+
+def _search_index_ddl(fts, table, columns):
+    cols = ', '.join(columns)
+    new = ', '.join('new.' + c for c in columns)
+    old = ', '.join('old.' + c for c in columns)
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({cols}, "
+        f"content='{table}', content_rowid='id', tokenize='trigram')",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN "
+        f"INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.id, {old}); END",
+        # 只在被索引的列变化时才更新，避免无关的 UPDATE 重写索引
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF id, {cols} ON {table} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.id, {old}); "
+        f"INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new}); END",
+    ]
+
+
+@event.listens_for(db.metadata, 'after_create')
+def create_search_indexes(target, connection, **kw):
+    if connection.dialect.name != 'sqlite':
+        return
+    for fts, (table, columns) in SEARCH_INDEXES.items():
+        exists = connection.exec_driver_sql(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (fts,)).first()
+        for statement in _search_index_ddl(fts, table, columns):
+            connection.exec_driver_sql(statement)
+        if not exists:  # 新建索引时把表里已有的数据补进去
+            connection.exec_driver_sql(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+
+
+@event.listens_for(db.metadata, 'before_drop')
+def drop_search_indexes(target, connection, **kw):
+    if connection.dialect.name != 'sqlite':
+        return
+    for fts in SEARCH_INDEXES:
+        connection.exec_driver_sql(f'DROP TABLE IF EXISTS {fts}')  # 触发器随被索引的表一起删除
+
+
+@contextmanager
+def search_indexes_suspended(execute):
+    # 大批量写入期间先去掉同步触发器，写完后一次性重建全文索引，比逐行维护快得多
+    # execute 可以是 SQLAlchemy 连接的 exec_driver_sql，也可以是 sqlite3 连接的 execute
+    indexes = {fts: spec for fts, spec in SEARCH_INDEXES.items() if execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (fts,)).fetchone() is not None}
+    for fts in indexes:
+        for suffix in ('ai', 'ad', 'au'):
+            execute(f'DROP TRIGGER IF EXISTS {fts}_{suffix}')
+    # 批量写入中途失败也要恢复：importsql 在自动提交模式下执行，删掉的触发器已经生效，不恢复就再也不会同步
+    try:
+        yield
+    finally:
+        for fts, (table, columns) in indexes.items():
+            for statement in _search_index_ddl(fts, table, columns):
+                execute(statement)
+            execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+
+
+# 每部电影的演职员人数和每个演员的作品数：relationship 上的触发器在写入时重新统计受影响的行，
+# 列表页直接读列，不用逐行 COUNT；格式为 {表名: (计数列, relationship 中指向该表的列, 另一端的列)}
+RELATIONSHIP_COUNTS = {
+    'movie': ('cast_count', 'id1', 'id2'),
+    'actor': ('film_count', 'id2', 'id1'),
+}
+
+
+def _relationship_count_ddl():
+    def refresh(row):
+        # 同一个人在一部电影里既导又演只算一次；走 relationship 上的 (id1, type) / (id2, type) 索引
+        return ' '.join(
+            f'UPDATE {table} SET {column} = (SELECT count(DISTINCT {other}) FROM relationship '
+            f'WHERE {key} = {row}.{key}) WHERE id = {row}.{key};'
+            for table, (column, key, other) in RELATIONSHIP_COUNTS.items())
+    return [
+        f'CREATE TRIGGER IF NOT EXISTS relationship_count_ai AFTER INSERT ON relationship BEGIN '
+        f'{refresh("new")} END',
+        f'CREATE TRIGGER IF NOT EXISTS relationship_count_ad AFTER DELETE ON relationship BEGIN '
+        f'{refresh("old")} END',
+        # 重新统计而不是加减一：修改电影 id 时级联更新的 relationship 行也不会算错
+        # 重新导入同样的数据时 upsert 会原样覆盖 id1 / id2，这时不必重新统计
+        f'CREATE TRIGGER IF NOT EXISTS relationship_count_au AFTER UPDATE OF id1, id2 ON relationship '
+        f'WHEN old.id1 IS NOT new.id1 OR old.id2 IS NOT new.id2 BEGIN {refresh("old")} {refresh("new")} END',
+    ]
+
+
+def _recount_sql():
+    # 全量重新统计，用 GROUP BY 一次扫描 relationship，不依赖二级索引（importsql 期间索引已被删除）
+    statements = []
+    for table, (column, key, other) in RELATIONSHIP_COUNTS.items():
+        statements.append(f'UPDATE {table} SET {column} = 0 WHERE {column} != 0')
+        statements.append(
+            f'UPDATE {table} SET {column} = c.n FROM (SELECT {key} AS id, count(DISTINCT {other}) AS n '
+            f'FROM relationship GROUP BY {key}) AS c WHERE {table}.id = c.id')
+    return statements
+
+
+@event.listens_for(db.metadata, 'after_create')
+def create_relationship_counts(target, connection, **kw):
+    if connection.dialect.name != 'sqlite':
+        return
+    for table, (column, _, _) in RELATIONSHIP_COUNTS.items():
+        if column not in {row[1] for row in connection.exec_driver_sql(f'PRAGMA table_info({table})')}:
+            return  # 老的 data.db 还没有计数列，交给 flask upgradedb
+    for statement in _relationship_count_ddl():
+        connection.exec_driver_sql(statement)
+
+
+@contextmanager
+def relationship_counts_suspended(execute):
+    # 和 search_indexes_suspended 一样：批量写入期间去掉计数触发器，写完（或失败）后全量统计一次
+    exists = execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'relationship_count_ai'").fetchone()
+    for suffix in ('ai', 'ad', 'au'):
+        execute(f'DROP TRIGGER IF EXISTS relationship_count_{suffix}')
+    try:
+        yield
+    finally:
+        if exists is not None:
+            for statement in _relationship_count_ddl() + _recount_sql():
+                execute(statement)
+
+
+def _recommendation_dirty_ddl():
+    # 一条 relationship 变了，这部电影和与它有共同演职员的电影之间的得分都会变
+    # 触发器里的 INSERT OR IGNORE 会被外层 upsert 语句的冲突处理覆盖，所以写成 ON CONFLICT DO NOTHING
+    def mark(row):
+        return (f'INSERT INTO recommendation_dirty (id) VALUES ({row}.id1) ON CONFLICT DO NOTHING; '
+                f'INSERT INTO recommendation_dirty (id) SELECT id1 FROM relationship WHERE id2 = {row}.id2 '
+                f'ON CONFLICT DO NOTHING;')
+    return [
+        f'CREATE TRIGGER IF NOT EXISTS recommendation_dirty_ai AFTER INSERT ON relationship BEGIN {mark("new")} END',
+        f'CREATE TRIGGER IF NOT EXISTS recommendation_dirty_ad AFTER DELETE ON relationship BEGIN {mark("old")} END',
+        f'CREATE TRIGGER IF NOT EXISTS recommendation_dirty_au AFTER UPDATE OF id1, id2, type ON relationship '
+        f'WHEN old.id1 IS NOT new.id1 OR old.id2 IS NOT new.id2 OR old.type IS NOT new.type BEGIN '
+        f'{mark("old")} {mark("new")} END',
+        'CREATE TRIGGER IF NOT EXISTS recommendation_dirty_movie_au AFTER UPDATE OF type, country ON movie '
+        'WHEN old.type IS NOT new.type OR old.country IS NOT new.country BEGIN '
+        'INSERT INTO recommendation_dirty (id) VALUES (new.id) ON CONFLICT DO NOTHING; '
+        'INSERT INTO recommendation_dirty (id) SELECT DISTINCT other.id1 FROM relationship AS own '
+        'JOIN relationship AS other ON other.id2 = own.id2 WHERE own.id1 = new.id ON CONFLICT DO NOTHING; END',
+    ]
+
+
+@event.listens_for(db.metadata, 'after_create')
+def create_recommendation_triggers(target, connection, **kw):
+    if connection.dialect.name != 'sqlite':
+        return
+    for statement in _recommendation_dirty_ddl():
+        connection.exec_driver_sql(statement)
+
+
+@contextmanager
+def recommendations_suspended(execute):
+    # 批量写入期间不逐行标记，写完后把所有电影都标记为需要重算
+    exists = execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'recommendation_dirty_ai'").fetchone()
+    for suffix in ('ai', 'ad', 'au', 'movie_au'):
+        execute(f'DROP TRIGGER IF EXISTS recommendation_dirty_{suffix}')
+    try:
+        yield
+    finally:
+        if exists is not None:
+            for statement in _recommendation_dirty_ddl():
+                execute(statement)
+            execute('INSERT OR IGNORE INTO recommendation_dirty (id) SELECT id FROM movie')
+
+
+def _movie_facet_ddl():
+    def change(row, delta):
+        key = f"coalesce({row}.country, ''), coalesce({row}.type, ''), coalesce({row}.release_year, 0)"
+        return (f'INSERT INTO movie_facet (country, type, release_year, count) VALUES ({key}, {delta}) '
+                f'ON CONFLICT (country, type, release_year) DO UPDATE SET count = count + {delta}; '
+                f'DELETE FROM movie_facet WHERE (country, type, release_year) = ({key}) AND count <= 0;')
+    return [
+        f'CREATE TRIGGER IF NOT EXISTS movie_facet_ai AFTER INSERT ON movie BEGIN {change("new", 1)} END',
+        f'CREATE TRIGGER IF NOT EXISTS movie_facet_ad AFTER DELETE ON movie BEGIN {change("old", -1)} END',
+        # 只改了标题等其它列时不碰汇总表；upsert 原样覆盖这几列时也一样
+        f'CREATE TRIGGER IF NOT EXISTS movie_facet_au AFTER UPDATE OF country, type, release_year ON movie '
+        f'WHEN old.country IS NOT new.country OR old.type IS NOT new.type '
+        f'OR old.release_year IS NOT new.release_year BEGIN {change("old", -1)} {change("new", 1)} END',
+    ]
+
+
+def _movie_facet_rebuild_sql():
+    # 全量重新汇总，一次扫描 movie
+    return [
+        'DELETE FROM movie_facet',
+        "INSERT INTO movie_facet (country, type, release_year, count) SELECT coalesce(country, ''), "
+        "coalesce(type, ''), coalesce(release_year, 0), count(*) FROM movie GROUP BY 1, 2, 3",
+    ]
+
+
+@event.listens_for(db.metadata, 'after_create')
+def create_movie_facets(target, connection, **kw):
+    if connection.dialect.name != 'sqlite':
+        return
+    if 'release_year' not in {row[1] for row in connection.exec_driver_sql('PRAGMA table_info(movie)')}:
+        return  # 老的 data.db 还没有上映年份列，交给 flask upgradedb
+    if connection.exec_driver_sql(
+            "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'movie_facet_ai'").first() is None:
+        # 第一次建触发器时 movie 里可能已经有数据，先汇总一次
+        for statement in _movie_facet_ddl() + _movie_facet_rebuild_sql():
+            connection.exec_driver_sql(statement)
+
+
+@contextmanager
+def movie_facets_suspended(execute):
+    # 批量写入期间去掉汇总触发器，写完后全量汇总一次
+    exists = execute("SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'movie_facet_ai'").fetchone()
+    for suffix in ('ai', 'ad', 'au'):
+        execute(f'DROP TRIGGER IF EXISTS movie_facet_{suffix}')
+    try:
+        yield
+    finally:
+        if exists is not None:
+            for statement in _movie_facet_ddl() + _movie_facet_rebuild_sql():
+                execute(statement)
+
+
+@contextmanager
+def derived_data_suspended(execute):
+    # 批量写入时暂停全部派生数据的触发器：全文索引、计数、推荐和分面汇总
+    with search_indexes_suspended(execute), relationship_counts_suspended(execute), \
+            recommendations_suspended(execute), movie_facets_suspended(execute):
+        yield
+
+
+# 数据变更跟踪：记录一个事务里改动了哪些表的哪些主键，提交成功后通知 @on_commit 注册的回调
+# changes 的格式为 {表名: 主键集合}，主键集合为 None 表示整张表都可能变了（批量语句、级联删除）
+# 注意 after_commit 时会话里已不能再执行 SQL，回调只应标记缓存失效，需要查库的等下次访问再做
+_commit_listeners = []
+
+
+def on_commit(func):
+    _commit_listeners.append(func)
+    return func
+
+
+def _utcnow():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _bump_version(session, table):
+    # 直接在会话的连接上执行，和业务写入在同一个事务里提交或回滚
+    statement = sqlite_insert(TableVersion.__table__).values(name=table, version=1, updated_at=_utcnow())
+    statement = statement.on_conflict_do_update(
+        index_elements=['name'],
+        set_={'version': TableVersion.__table__.c.version + 1, 'updated_at': statement.excluded.updated_at})
+    session.connection().execute(statement)
+
+
+def _mark_changed(session, table, ids):
+    changes = session.info.setdefault('changes', {})
+    if table not in changes and table != TableVersion.__tablename__:
+        _bump_version(session, table)  # 每个事务里每张表只递增一次
+    if ids is None or (table in changes and changes[table] is None):
+        changes[table] = None
+    else:
+        # 表单提交的 id 可能还是字符串
+        changes.setdefault(table, set()).update(int(i) for i in ids if i is not None)
+
+
+def _mark_dependents_changed(session, table):
+    # 删除或修改主键时数据库会级联修改引用它的表，ORM 看不到这些行
+    for other in db.metadata.tables.values():
+        if any(fk.column.table.name == table for fk in other.foreign_keys):
+            _mark_changed(session, other.name, None)
+
+
+@event.listens_for(Session, 'after_flush')
+def _track_flush(session, flush_context):
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        table = getattr(obj, '__tablename__', None)
+        if table is None or (obj in session.dirty and not session.is_modified(obj)):
+            continue
+        ids = {obj.id}
+        history = db.inspect(obj).attrs.id.history
+        if obj in session.deleted or history.deleted:
+            ids.update(history.deleted)
+            _mark_dependents_changed(session, table)
+        _mark_changed(session, table, ids)
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _track_bulk(orm_execute_state):
+    # session.execute(insert(Movie), rows) 这类批量语句不经过 flush
+    if not (orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    mapper = orm_execute_state.bind_mapper
+    if mapper is None:
+        return
+    table = mapper.local_table.name
+    session = orm_execute_state.session
+    params = orm_execute_state.parameters
+    if orm_execute_state.is_insert and isinstance(params, list) and all('id' in p for p in params):
+        _mark_changed(session, table, {p['id'] for p in params})
+        return
+    _mark_changed(session, table, None)
+    if orm_execute_state.is_delete or orm_execute_state.is_update:
+        _mark_dependents_changed(session, table)
+
+
+@event.listens_for(Session, 'after_commit')
+def _notify_commit(session):
+    changes = session.info.pop('changes', None)
+    if changes:
+        for listener in _commit_listeners:
+            listener(changes)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_changes(session):
+    session.info.pop('changes', None)
+
+
+def _chunks(items, size=500):
+    # IN 查询分批，避免超出 SQLite 的参数个数上限
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def existing_ids(model, ids):
+    found = set()
+    for chunk in _chunks(ids):
+        found.update(db.session.execute(select(model.id).where(model.id.in_(chunk))).scalars())
+    return found
+
+
+def upsert_rows(model, rows):
+    # INSERT ... ON CONFLICT(id) DO UPDATE，整批作为一次 executemany 执行；不提交事务
+    if not rows:
+        return
+    # 直接用 Core 语句比 ORM 批量写入快三分之一左右，改动需要自己登记给变更跟踪
+    with_derived_columns(model.__tablename__, rows)
+    statement = sqlite_insert(model.__table__)
+    statement = statement.on_conflict_do_update(
+        index_elements=['id'], set_={name: statement.excluded[name] for name in rows[0] if name != 'id'})
+    db.session.execute(statement, rows)
+    _mark_changed(db.session, model.__tablename__, {row['id'] for row in rows})
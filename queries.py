@@ -0,0 +1,193 @@
+# 页面和 JSON 接口共用的查询工具：按主键翻页、上映日期范围、分面筛选和计数、电影表单校验
+from flask import request, url_for, abort, g
+
+from collections import OrderedDict, namedtuple
+from datetime import date
+
+from sqlalchemy import func, literal_column
+
+from models import db, Movie, MovieFacet, TableVersion, release_date_bound
+
+
+PAGE_SIZE = 20  # 列表页默认每页条数
+MAX_PAGE_SIZE = 100  # ?limit= 允许的最大值
+
+Page = namedtuple('Page', ['items', 'limit', 'prev_url', 'next_url'])
+
+
+def _page_url(**cursor):
+    # 保留当前查询参数，只替换游标参数
+    args = request.args.to_dict()
+    args.pop('after', None)
+    args.pop('before', None)
+    args.update(cursor)
+    return url_for(request.endpoint, **(request.view_args or {}), **args)
+
+
+def keyset_page(query, column):
+    # 基于主键的游标（keyset）分页：?after=<id> 向后翻页，?before=<id> 向前翻页
+    # 每页只做一次走主键索引的范围查询，代价与表的大小和翻页深度无关（不像 OFFSET 越翻越慢）
+    limit = request.args.get('limit', PAGE_SIZE, type=int)
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    after = request.args.get('after', type=int)
+    before = request.args.get('before', type=int)
+    key = column.key
+
+    if before is not None:
+        items = query.filter(column < before).order_by(column.desc()).limit(limit + 1).all()
+        has_prev = len(items) > limit
+        items = items[:limit][::-1]
+        has_next = True  # 从 before 翻回来，后面至少还有 before 这一条
+    else:
+        if after is not None:
+            query = query.filter(column > after)
+        items = query.order_by(column).limit(limit + 1).all()
+        has_next = len(items) > limit
+        items = items[:limit]
+        has_prev = after is not None
+
+    prev_url = next_url = None
+    if items and has_prev:
+        prev_url = _page_url(before=getattr(items[0], key))
+    if items and has_next:
+        next_url = _page_url(after=getattr(items[-1], key))
+    # 本页覆盖的主键范围 (lo, hi]，None 表示该方向不设边界；页面缓存据此判断改动是否落在本页
+    if before is not None:
+        lo = getattr(items[0], key) - 1 if has_prev and items else None
+        hi = before - 1
+    else:
+        lo = after
+        hi = getattr(items[-1], key) if has_next else None
+    g.page_bounds = (column.table.name, lo, hi)
+    return Page(items, limit, prev_url, next_url)
+
+
+def release_date_filters():
+    # 列表和搜索页的 ?from=2019&to=2019-06 上映日期范围过滤，返回过滤条件列表
+    # SQLite 没有列值的分布统计，范围多宽都按同一个比例估算：范围很窄时可能按主键扫全表，很宽时又可能走索引再排序。
+    # 这里按列的 min / max 估算范围选中的比例，用 likelihood() 告诉查询规划器；min / max 按 movie 表的版本号缓存
+    bounds = {}  # 列 -> [下界, 上界]
+    for name, upper in (('from', False), ('to', True)):
+        value = (request.values.get(name) or '').strip()
+        if not value:
+            continue
+        bound = release_date_bound(value, upper)
+        if bound is None:
+            abort(400, f'invalid {name} date: {value}')
+        column, limit = bound
+        bounds.setdefault(column, [None, None])[upper] = limit
+    criteria = []
+    version = db.session.query(TableVersion.version).filter(TableVersion.name == 'movie').scalar() if bounds else None
+    for column, (start, end) in bounds.items():
+        terms = ([column >= start] if start is not None else []) + ([column <= end] if end is not None else [])
+        lo, hi = _release_date_range(column, version)
+        if lo is not None and lo < hi:
+            start = 0 if start is None else (_ordinal(start) - lo) / (hi - lo)
+            end = 1 if end is None else (_ordinal(end) - lo) / (hi - lo)
+            share = min(max(end - start, 0.001), 1.0)
+            # 规划器把各条件的比例相乘，同一列的上下界各分一半（开平方），乘起来才是整个范围的比例
+            share = share ** (1 / len(terms))
+            terms = [func.likelihood(term, literal_column(f'{share:.3f}')) for term in terms]
+        criteria += terms
+    return criteria
+
+
+_release_date_ranges = {}  # 列名 -> (movie 表版本号, 最小值, 最大值)
+
+
+def _release_date_range(column, version):
+    # 只用于估算比例，数据没变时不再查 min / max；其它进程写入后版本号也会变
+    cached = _release_date_ranges.get(column.key)
+    if cached is None or cached[0] != version:
+        lo, hi = (_ordinal(db.session.query(aggregate(column)).scalar()) for aggregate in (func.min, func.max))
+        cached = _release_date_ranges[column.key] = (version, lo, hi)
+    return cached[1:]
+
+
+def _ordinal(value):
+    return value.toordinal() if isinstance(value, date) else value
+
+
+# 列表页的分面：查询参数 -> (movie 上的列, movie_facet 上的列, 汇总表里表示“空”的值)
+FACETS = {
+    'country': (Movie.country, MovieFacet.country, ''),
+    'type': (Movie.type, MovieFacet.type, ''),
+    'year': (Movie.release_year, MovieFacet.release_year, 0),
+}
+
+
+def facet_selection():
+    # ?country=中国&type=科幻&year=2019 里选中的分面，返回 {分面: 值}
+    selection = {}
+    for name in FACETS:
+        value = (request.values.get(name) or '').strip()
+        if not value:
+            continue
+        if name == 'year':
+            if not value.isdigit():
+                abort(400, f'invalid year: {value}')
+            value = int(value)
+        selection[name] = value
+    return selection
+
+
+def facet_filters(selection):
+    # 等值条件，走 (country, type, id) 等索引，按 id 翻页时不需要排序
+    return [FACETS[name][0] == value for name, value in selection.items()]
+
+
+FACET_CACHE_SIZE = 256  # 进程内缓存多少种分面组合的计数
+
+
+_facet_cache = OrderedDict()  # 选中的分面 -> (movie 表版本号, 计数)
+
+
+def facet_counts(selection):
+    # 每一栏只按其它栏的选择过滤（选了“中国”之后国家一栏仍然列出其它国家各有多少部），全部读 movie_facet 小表
+    # 返回 {分面: [(值, 电影数), ...]}，年份从新到旧、其余按电影数从多到少；该列为空的电影不列出
+    # 结果按 movie 表的版本号缓存，其它进程写入后版本号也会变，读一次版本号就能确认缓存是否可用
+    key = tuple(sorted(selection.items()))
+    version = db.session.query(TableVersion.version).filter(TableVersion.name == 'movie').scalar()
+    cached = _facet_cache.get(key)
+    if cached is not None and cached[0] == version:
+        _facet_cache.move_to_end(key)
+        return cached[1]
+    counts = {}
+    for name, (_, column, empty) in FACETS.items():
+        total = func.sum(MovieFacet.count)
+        query = db.session.query(column, total).filter(column != empty, *(
+            FACETS[other][1] == value for other, value in selection.items() if other != name))
+        counts[name] = [tuple(row) for row in query.group_by(column)
+                        .order_by(column.desc() if name == 'year' else total.desc(), column)]
+    _facet_cache[key] = (version, counts)
+    while len(_facet_cache) > FACET_CACHE_SIZE:
+        _facet_cache.popitem(last=False)
+    return counts
+
+
+def _facet_url(name, value=None):
+    # 保留其它查询参数，选中（value 为 None 时取消）一个分面，并回到第一页
+    args = request.args.to_dict()
+    for key in ('after', 'before', name):
+        args.pop(key, None)
+    if value is not None:
+        args[name] = value
+    return url_for(request.endpoint, **args)
+
+
+def validate_movie(title, year):
+    # 首页表单、编辑页和批量接口共用的校验规则；合法时返回 None，否则返回错误信息
+    if not title or not year:
+        return 'title and year are required'
+    if len(title) > 60:
+        return 'title is longer than 60 characters'
+    if len(year) > 20:
+        return 'year is longer than 20 characters'
+    return None
+
+
+def similar_movies(similar):
+    # 预先算好的 id 列表按主键取出，保持推荐的顺序；已删除的电影直接跳过
+    ids = [int(i) for i in similar.split(',') if i] if similar else []
+    movies = {movie.id: movie for movie in Movie.query.filter(Movie.id.in_(ids))} if ids else {}
+    return [movies[i] for i in ids if i in movies]
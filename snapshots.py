@@ -0,0 +1,77 @@
+from flask import current_app
+
+import threading
+
+from sqlalchemy import func, select
+
+from models import db, TableVersion
+
+
+class SnapshotIndex:
+    # 常驻内存的派生索引（合作关系图、联想词索引）的维护逻辑：
+    # snapshot_class(connection) 从数据库整体构建一份快照，snapshot.apply(session, {表名: 主键集合}) 增量同步，
+    # 增量覆盖的条目超过 max_patched 时 patched_size() 用来决定重建
+    # 本进程提交的改动按主键增量同步；其它 worker 的写入（版本号对不上）或批量语句则后台重建，重建期间继续用旧快照回答
+    def __init__(self, snapshot_class, tables, max_patched):
+        self.snapshot_class = snapshot_class
+        self.tables = tables
+        self.max_patched = max_patched
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._version = None  # 快照对应的各表版本号之和
+        self._pending = {}  # 提交后还没同步进快照的 {表名: 主键集合}，None 表示只能重建
+        self._local_bumps = 0  # 同一期间本进程的提交让版本号之和增加了多少
+        self._rebuilding = False
+
+    def invalidate(self, changes):
+        touched = [table for table in self.tables if table in changes]
+        if not touched:
+            return
+        with self._lock:
+            self._local_bumps += len(touched)  # 每个事务里每张表的版本号只加一
+            for table in touched:
+                if changes[table] is None or self._pending is None:
+                    self._pending = None
+                else:
+                    self._pending.setdefault(table, set()).update(changes[table])
+
+    def _current_version(self, connection):
+        return connection.execute(select(func.sum(TableVersion.version)).where(
+            TableVersion.name.in_(self.tables))).scalar() or 0
+
+    def _build(self, connection):
+        with self._lock:
+            self._pending, self._local_bumps = {}, 0
+        version = self._current_version(connection)
+        snapshot = self.snapshot_class(connection)
+        with self._lock:
+            self._snapshot, self._version, self._rebuilding = snapshot, version, False
+        return snapshot
+
+    def _build_in_background(self, app):
+        try:
+            with app.app_context(), db.engine.connect() as connection:
+                self._build(connection)
+        finally:
+            self._rebuilding = False
+
+    def get(self):
+        version = self._current_version(db.session)
+        with self._lock:
+            snapshot = self._snapshot
+            up_to_date = (snapshot is not None and self._pending is not None
+                          and version == self._version + self._local_bumps)
+            if up_to_date and self._pending:
+                snapshot.apply(db.session, self._pending)
+                self._pending, self._local_bumps, self._version = {}, 0, version
+                up_to_date = snapshot.patched_size() <= self.max_patched
+            elif up_to_date:
+                return snapshot
+            if snapshot is not None and not up_to_date and not self._rebuilding:
+                self._rebuilding = True
+                threading.Thread(target=self._build_in_background, args=(current_app._get_current_object(),),
+                                 daemon=True).start()
+        if snapshot is None:
+            with db.engine.connect() as connection:  # 第一次使用时同步构建
+                snapshot = self._build(connection)
+        return snapshot
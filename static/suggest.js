@@ -0,0 +1,28 @@
+// 搜索框联想：输入时请求 /suggest，把结果填进输入框关联的 datalist
+document.querySelectorAll('input[data-suggest]').forEach(function (input) {
+	var list = document.getElementById(input.getAttribute('list'));
+	var kind = input.dataset.suggest;  // movies 或 actors
+	var field = kind === 'movies' ? 'title' : 'name';
+	var latest = 0;
+	input.addEventListener('input', function () {
+		var q = input.value.trim();
+		var request = ++latest;
+		if (!q) {
+			list.innerHTML = '';
+			return;
+		}
+		fetch(input.dataset.url + '?q=' + encodeURIComponent(q))
+			.then(function (response) { return response.json(); })
+			.then(function (data) {
+				if (request !== latest) {
+					return;  // 只显示最后一次输入的结果
+				}
+				list.innerHTML = '';
+				data[kind].forEach(function (item) {
+					var option = document.createElement('option');
+					option.value = item[field];
+					list.appendChild(option);
+				});
+			});
+	});
+});
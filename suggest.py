@@ -0,0 +1,147 @@
+import bisect
+import itertools
+from array import array
+from collections import Counter
+
+from sqlalchemy import select
+
+from models import db, on_commit, _chunks
+from snapshots import SnapshotIndex
+
+
+# 搜索框联想：标题和演员名常驻内存，前缀用排好序的数组二分查找，中间的子串用二字组倒排索引
+SUGGEST_SOURCES = {'movie': ('title', 'movies'), 'actor': ('name', 'actors')}  # 表名 -> (列名, 返回的键)
+SUGGEST_LIMIT = 10
+SUGGEST_SCAN_LIMIT = 5000  # 子串匹配最多检查的候选数，常见的二字组也能在几毫秒内返回
+SUGGEST_MAX_PATCHED = 10000  # 增量覆盖的条目超过这个数就重建
+FUZZY_MIN_LENGTH = 3  # 再短的关键字容错匹配没有意义，几乎什么都能匹配上
+FUZZY_POSTING_LIMIT = 50000  # 比这更长的倒排表不参与计数，只相应降低需要命中的二字组数
+FUZZY_CANDIDATES = 1000  # 最多对这么多候选计算编辑距离
+
+
+def _suggest_key(text):
+    key = text.casefold()
+    return text if key == text else key  # 中文通常不变，复用同一个字符串对象，省一半内存
+
+
+def _bigrams(key):
+    return {key[i:i + 2] for i in range(len(key) - 1)}
+
+
+def _substring_distance(pattern, text):
+    # pattern 与 text 中任意一段子串之间的最小编辑距离（text 首尾多出的字符不计）
+    previous = list(range(len(pattern) + 1))
+    best = previous[-1]
+    for char in text:
+        current = [0]
+        for i, pattern_char in enumerate(pattern, 1):
+            current.append(min(previous[i] + 1, current[i - 1] + 1, previous[i - 1] + (pattern_char != char)))
+        best = min(best, current[-1])
+        if not best:
+            break
+        previous = current
+    return best
+
+
+class SuggestSnapshot:
+    def __init__(self, connection):
+        # 每张表三个按 key 排序的平行数组：key、id、原文；倒排表为 {二字组: 位置 array}
+        self.sources = {}
+        cursor = connection.connection.cursor()
+        for table, (column, _) in SUGGEST_SOURCES.items():
+            cursor.execute(f'SELECT id, {column} FROM {table} WHERE {column} IS NOT NULL')
+            entries = sorted((_suggest_key(text), entry_id, text) for entry_id, text in cursor)
+            keys = [entry[0] for entry in entries]
+            ids = array('q', [entry[1] for entry in entries])
+            texts = [entry[2] for entry in entries]
+            del entries
+            postings = {}
+            for position, key in enumerate(keys):
+                for gram in _bigrams(key):
+                    if gram in postings:
+                        postings[gram].append(position)
+                    else:
+                        postings[gram] = array('i', [position])
+            self.sources[table] = (keys, ids, texts, postings)
+        cursor.close()
+        self.patched = {table: {} for table in SUGGEST_SOURCES}  # id -> 最新的 (key, 原文)，已删除为 None；只整体替换
+
+    def apply(self, session, pending):
+        for table, entry_ids in pending.items():
+            source = db.metadata.tables[table]
+            column = source.c[SUGGEST_SOURCES[table][0]]
+            current = dict.fromkeys(entry_ids)
+            for chunk in _chunks(entry_ids):
+                for entry_id, text in session.execute(select(source.c.id, column).where(source.c.id.in_(chunk))):
+                    current[entry_id] = None if text is None else (_suggest_key(text), text)
+            # 写时复制：查询线程不加锁遍历 patched，原地 update 会让它们报 dictionary changed size during iteration；
+            # 换成新字典后，正在遍历的线程继续用旧字典
+            self.patched[table] = {**self.patched[table], **current}
+
+    def patched_size(self):
+        return sum(len(patched) for patched in self.patched.values())
+
+    def suggest(self, table, text, limit):
+        # 先返回前缀匹配，再返回子串匹配；返回 [(id, 原文)]
+        keys, ids, texts, postings = self.sources[table]
+        patched = self.patched[table]
+        key = _suggest_key(text)
+        results = {}
+        i = bisect.bisect_left(keys, key)
+        while i < len(keys) and len(results) < limit and keys[i].startswith(key):
+            if ids[i] not in patched:  # 快照之后改过的条目以 patched 为准
+                results.setdefault(ids[i], texts[i])
+            i += 1
+        for entry_id, entry in patched.items():
+            if len(results) >= limit:
+                break
+            if entry is not None and key in entry[0]:
+                results.setdefault(entry_id, entry[1])
+        if len(results) < limit and len(key) >= 2:
+            lists = [postings.get(gram) for gram in _bigrams(key)]
+            if all(lists):
+                # 只需遍历最短的倒排表，逐个验证是否真的包含整个关键字
+                for position in itertools.islice(min(lists, key=len), SUGGEST_SCAN_LIMIT):
+                    if key in keys[position] and ids[position] not in patched:
+                        results.setdefault(ids[position], texts[position])
+                        if len(results) >= limit:
+                            break
+        return list(results.items())
+
+    def fuzzy(self, table, text, limit):
+        # 容错匹配：编辑距离不超过 k 的串至少保留 len(二字组) - 2k 个二字组、len - k 个字符，
+        # 先按命中的二字组数从多到少过滤，再逐个算编辑距离；返回 [(id, 原文)]
+        keys, ids, texts, postings = self.sources[table]
+        patched = self.patched[table]
+        key = _suggest_key(text)
+        if len(key) < FUZZY_MIN_LENGTH:
+            return []
+        k = 1 if len(key) <= 4 else 2
+        grams = _bigrams(key)
+        needed = max(1, len(grams) - 2 * k)
+        candidates = []  # (命中数, id, key, 原文)，按命中数从多到少
+        lists = [postings[gram] for gram in grams if gram in postings]
+        usable = [positions for positions in lists if len(positions) <= FUZZY_POSTING_LIMIT]
+        if needed - (len(lists) - len(usable)) >= 1:
+            counts = Counter(itertools.chain.from_iterable(usable))
+            candidates = ((hits, ids[position], keys[position], texts[position])
+                          for position, hits in counts.most_common()
+                          if hits >= needed - (len(lists) - len(usable)) and ids[position] not in patched)
+        recent = [(hits, entry_id, entry[0], entry[1]) for entry_id, entry in patched.items() if entry is not None
+                  for hits in [sum(gram in entry[0] for gram in grams)] if hits >= needed]
+        matches, verified = [], 0
+        for hits, entry_id, candidate, original in itertools.chain(recent, candidates):
+            if verified >= FUZZY_CANDIDATES:
+                break
+            if sum(char in candidate for char in key) < len(key) - k:
+                continue
+            verified += 1
+            distance = _substring_distance(key, candidate)
+            if distance <= k:
+                matches.append((distance, -hits, len(candidate), entry_id, original))
+        matches.sort()
+        return [(entry_id, original) for *_, entry_id, original in matches[:limit]]
+
+
+suggest_index = SnapshotIndex(SuggestSnapshot, tuple(SUGGEST_SOURCES), max_patched=SUGGEST_MAX_PATCHED)
+on_commit(suggest_index.invalidate)
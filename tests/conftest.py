@@ -0,0 +1,50 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# app.py 在导入时读取数据库路径，必须先设置好环境变量
+DATABASE_FILE = os.path.join(tempfile.mkdtemp(prefix='watchlist-tests-'), 'test.db')
+os.environ['DATABASE_FILE'] = DATABASE_FILE
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as watchlist  # noqa: E402
+import graph  # noqa: E402
+import queries  # noqa: E402
+import suggest  # noqa: E402
+
+
+def reset_database():
+    # 关闭连接池里的连接再删文件，否则下一个测试会连到已删除的旧文件
+    with watchlist.app.app_context():
+        watchlist.db.engine.dispose()
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(DATABASE_FILE + suffix):
+            os.remove(DATABASE_FILE + suffix)
+    # 进程内按版本号缓存的结果：新库的版本号从头开始，旧条目可能恰好对得上
+    watchlist.page_cache.clear()
+    watchlist.invalidate_user_cache()
+    queries._facet_cache.clear()
+    queries._release_date_ranges.clear()
+    for index in (suggest.suggest_index, graph.costar_graph):
+        index._snapshot = None
+
+
+@pytest.fixture
+def app():
+    reset_database()
+    watchlist.app.config['TESTING'] = True
+    with watchlist.app.app_context():
+        yield watchlist.app
+    reset_database()
+
+
+@pytest.fixture
+def forged(app):
+    # 内置的示例数据：18 部电影、演员、票房和演职员关系，管理员账号 admin / admin
+    result = app.test_cli_runner().invoke(args=['forge', '--count', '0'])
+    assert result.exit_code == 0, result.output
+    result = app.test_cli_runner().invoke(args=['admin', '--username', 'admin', '--password', 'admin'])
+    assert result.exit_code == 0, result.output
+    return app
@@ -0,0 +1,23 @@
+def test_costar_path(forged):
+    client = forged.test_client()
+    response = client.get('/api/v1/actors/2001/costars')
+    assert response.status_code == 200
+    costars = response.get_json()['hops'][0]['ids']
+    assert costars
+    path = client.get(f'/api/v1/actors/2001/path/{costars[0]}').get_json()
+    assert path['hops'] == 1
+    assert [item['type'] for item in path['path']] == ['actor', 'movie', 'actor']
+    assert client.get('/api/v1/actors/999999/costars').status_code == 404
+
+
+def test_suggest(forged):
+    response = forged.test_client().get('/suggest', query_string={'q': '战狼'})
+    assert [movie['id'] for movie in response.get_json()['movies']] == [1001]
+
+
+def test_list_and_facets(forged):
+    client = forged.test_client()
+    assert client.get('/api/v1/movies?limit=5').status_code == 200
+    facets = client.get('/api/v1/movies/facets?country=中国').get_json()
+    assert facets['country']
+    assert client.get('/api/v1/nothing').status_code == 404
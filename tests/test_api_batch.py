@@ -0,0 +1,34 @@
+def _client(app):
+    client = app.test_client()
+    assert client.post('/login', data={'username': 'admin', 'password': 'admin'}).location == '/'
+    return client
+
+
+def test_batch_rejects_non_string_fields(forged):
+    client = _client(forged)
+    response = client.post('/api/v1/movies/batch', json={
+        'upserts': [{'id': 5001, 'title': 'X', 'year': 2019},
+                    {'id': 5002, 'title': 'Y', 'year': '2019', 'country': ['中国']},
+                    {'id': 5003, 'title': '长安三万里', 'year': '2023'}]})
+    assert response.status_code == 200
+    results = response.get_json()['results']
+    assert [(result['status'], result.get('error')) for result in results] == [
+        ('error', 'year must be a string'), ('error', 'country must be a string'), ('created', None)]
+
+
+def test_batch_requires_lists(forged):
+    client = _client(forged)
+    for payload in ({'upserts': {'id': 5001}}, {'deletes': 5001}, {'upserts': 'x'}):
+        assert client.post('/api/v1/movies/batch', json=payload).status_code == 400
+
+
+def test_batch_rejects_non_integer_ids(forged):
+    client = _client(forged)
+    response = client.post('/api/v1/movies/batch', json={
+        'upserts': [{'id': 1.9, 'title': 'X', 'year': '2019'}, {'id': '5001', 'title': 'Y', 'year': '2019'}],
+        'deletes': [True, '1.9', None]})
+    assert response.status_code == 200
+    results = response.get_json()['results']
+    assert [(result['status'], result.get('error')) for result in results] == [
+        ('error', 'id must be an integer'), ('created', None), ('error', 'id must be an integer'),
+        ('error', 'id must be an integer'), ('error', 'id must be an integer')]
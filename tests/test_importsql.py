@@ -0,0 +1,127 @@
+import sqlite3
+import time
+
+from conftest import DATABASE_FILE, watchlist
+
+
+def _query(sql):
+    connection = sqlite3.connect(DATABASE_FILE)
+    try:
+        return connection.execute(sql).fetchall()
+    finally:
+        connection.close()
+
+
+def _triggers():
+    return {row[0] for row in _query("SELECT name FROM sqlite_master WHERE type = 'trigger'")}
+
+
+def test_import_restores_triggers(forged, tmp_path):
+    triggers = _triggers()
+    dump = tmp_path / 'dump.sql'
+    dump.write_text("INSERT INTO movie (id, title, year, country, type) VALUES (5001, '长安三万里', '2023', '中国', '动画');\n"
+                    "INSERT INTO relationship (id, id1, id2, type) VALUES (9001, 5001, 2001, '主演');\n",
+                    encoding='utf-8')
+    result = forged.test_cli_runner().invoke(args=['importsql', str(dump), '--batch-size', '1'])
+    assert result.exit_code == 0, result.output
+    assert _triggers() == triggers
+    assert _query("SELECT rowid FROM movie_fts WHERE movie_fts MATCH '长安三万里'") == [(5001,)]
+    assert _query('SELECT cast_count FROM movie WHERE id = 5001') == [(1,)]
+
+
+def test_failed_import_restores_triggers(forged, tmp_path):
+    triggers = _triggers()
+    assert len(triggers) == 16
+    dump = tmp_path / 'dump.sql'
+    dump.write_text("INSERT INTO movie (id, title, year, country, type) VALUES (5001, '长安三万里', '2023', '中国', '动画');\n"
+                    "INSERT INTO no_such_table VALUES (1);\n", encoding='utf-8')
+    result = forged.test_cli_runner().invoke(args=['importsql', str(dump), '--batch-size', '1'])
+    assert result.exit_code != 0
+    assert 'Statement 2 failed' in result.output
+    # 第一条已经提交；触发器必须全部恢复，之后的写入照常同步
+    assert _triggers() == triggers
+    assert _query("SELECT rowid FROM movie_fts WHERE movie_fts MATCH '长安三万里'") == [(5001,)]
+    connection = sqlite3.connect(DATABASE_FILE)
+    with connection:
+        connection.execute("UPDATE movie SET title = '长安' WHERE id = 5001")
+    connection.close()
+    assert _query("SELECT rowid FROM movie_fts WHERE movie_fts MATCH '长安三万里'") == []
+
+
+def test_fill_derived_columns_in_chunks(forged):
+    connection = sqlite3.connect(DATABASE_FILE)
+    try:
+        with connection:
+            connection.execute('UPDATE movie SET release_date = NULL, release_year = NULL')
+            # 解析不出日期的行派生列仍为 NULL，分段翻页不能因此反复读到它
+            connection.execute("UPDATE movie SET year = '未知' WHERE id = 1001")
+        total = connection.execute('SELECT count(*) FROM movie').fetchone()[0]
+        with connection:
+            assert watchlist.fill_derived_columns(connection, sources={'year'}, chunk_size=3) == total
+        assert connection.execute('SELECT count(*) FROM movie WHERE release_year IS NULL').fetchone()[0] == 1
+    finally:
+        connection.close()
+
+
+def test_import_into_fresh_database_bumps_versions(app, tmp_path):
+    runner = app.test_cli_runner()
+    assert runner.invoke(args=['initdb']).exit_code == 0
+    client = app.test_client()
+    first = client.get('/')
+    assert client.get('/suggest', query_string={'q': '长安'}).get_json()['movies'] == []
+    dump = tmp_path / 'dump.sql'
+    dump.write_text("INSERT INTO movie (id, title, year, country, type) "
+                    "VALUES (5001, '长安三万里', '2023', '中国', '动画');\n", encoding='utf-8')
+    result = runner.invoke(args=['importsql', str(dump)])
+    assert result.exit_code == 0, result.output
+    # 新库里没有版本号记录，导入后也必须让 ETag、页面缓存和内存索引看到新数据
+    second = client.get('/', headers={'If-None-Match': first.headers['ETag']})
+    assert second.status_code == 200
+    assert '长安三万里' in second.get_data(as_text=True)
+    # 版本号变了，联想词索引在后台重建，重建完成前继续用旧快照回答
+    for _ in range(50):
+        movies = client.get('/suggest', query_string={'q': '长安'}).get_json()['movies']
+        if movies:
+            break
+        time.sleep(0.05)
+    assert [movie['id'] for movie in movies] == [5001]
+    assert client.get('/api/v1/movies/facets').get_json()['country'] == [{'value': '中国', 'count': 1}]
+
+
+def test_reindex_bumps_versions(forged):
+    before = dict(_query('SELECT name, version FROM table_version'))
+    result = forged.test_cli_runner().invoke(args=['reindex'])
+    assert result.exit_code == 0, result.output
+    after = dict(_query('SELECT name, version FROM table_version'))
+    for table in ('movie', 'actor', 'movie_facet'):
+        assert after[table] == before.get(table, 0) + 1
+
+
+def test_import_jsonl_restores_triggers(forged, tmp_path):
+    triggers = _triggers()
+    movies = tmp_path / 'movie.jsonl'
+    movies.write_text('{"id": 5001, "title": "长安三万里", "year": "2023", "country": "中国", "type": "动画"}\n',
+                      encoding='utf-8')
+    relationships = tmp_path / 'relationship.jsonl'
+    relationships.write_text('{"id": 9001, "id1": 5001, "id2": 2001, "type": "主演"}\n', encoding='utf-8')
+    runner = forged.test_cli_runner()
+    for table, data_file in [('movie', movies), ('relationship', relationships)]:
+        result = runner.invoke(args=['import', table, str(data_file)])
+        assert result.exit_code == 0, result.output
+    assert _triggers() == triggers
+    assert _query("SELECT rowid FROM movie_fts WHERE movie_fts MATCH '长安三万里'") == [(5001,)]
+    assert _query('SELECT cast_count FROM movie WHERE id = 5001') == [(1,)]
+
+
+def test_import_reports_bad_json_lines(forged, tmp_path):
+    triggers = _triggers()
+    data_file = tmp_path / 'movie.jsonl'
+    runner = forged.test_cli_runner()
+    for line, message in [('{"id": 5001, "title": ', 'Row 2: Expecting value'),
+                          ('[1, 2]', 'Row 2: expected a JSON object')]:
+        data_file.write_text('{"id": 5001, "title": "长安三万里", "year": "2023"}\n' + line + '\n', encoding='utf-8')
+        result = runner.invoke(args=['import', 'movie', str(data_file)])
+        assert result.exit_code != 0
+        assert message in result.output
+        assert 'Traceback' not in result.output
+        assert _triggers() == triggers
@@ -0,0 +1,44 @@
+import sqlite3
+
+from werkzeug.security import generate_password_hash
+
+from conftest import DATABASE_FILE, watchlist
+
+
+def _login(client, password):
+    # 登录成功重定向到主页，失败回到登录页
+    return client.post('/login', data={'username': 'admin', 'password': password}).location
+
+
+def test_password_changed_by_another_process(forged):
+    client = forged.test_client()
+    assert _login(client, 'admin') == '/'
+    assert watchlist.get_user() is not None  # 本进程的用户缓存已经填好
+    # 模拟另一个进程执行 flask admin --password：直接改库，本进程的缓存不会被清理
+    connection = sqlite3.connect(DATABASE_FILE)
+    with connection:
+        connection.execute('UPDATE user SET password_hash = ?', (generate_password_hash('changed'),))
+    connection.close()
+    client = forged.test_client()
+    assert _login(client, 'admin') == '/login'
+    assert _login(client, 'changed') == '/'
+
+
+def test_cached_user_loads_password_hash(forged):
+    watchlist.get_user()
+    user = watchlist.get_user()
+    assert user.validate_password('admin')
+
+
+def test_owner_renamed_by_another_process(forged):
+    client = forged.test_client()
+    owner = watchlist.get_user().name
+    assert f"{owner}'s Watchlist" in client.get('/actor').get_data(as_text=True)
+    # 另一个 worker 改了站点主人的名字：改库并递增 user 表的版本号，本进程的缓存没有被清理
+    connection = sqlite3.connect(DATABASE_FILE)
+    with connection:
+        connection.execute("UPDATE user SET name = 'Renamed'")
+        connection.execute("UPDATE table_version SET version = version + 1 WHERE name = 'user'")
+    connection.close()
+    assert "Renamed's Watchlist" in client.get('/actor').get_data(as_text=True)
+    assert watchlist.get_user().name == 'Renamed'
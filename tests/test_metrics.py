@@ -0,0 +1,17 @@
+from flask import render_template_string
+
+from conftest import watchlist
+
+
+def test_queries_outside_a_started_request(forged):
+    metrics = forged.config['METRICS']
+    forged.config['METRICS'] = True
+    try:
+        # 没有经过 before_request，g 里没有 metrics
+        with forged.test_request_context('/'):
+            assert watchlist.Movie.query.count() > 0
+            assert render_template_string('{{ 1 + 1 }}') == '2'
+        response = forged.test_client().get('/actor')
+        assert 'queries' in response.headers['Server-Timing']
+    finally:
+        forged.config['METRICS'] = metrics
@@ -0,0 +1,14 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.mark.parametrize('module', ['models', 'snapshots', 'suggest', 'graph', 'queries', 'api', 'app'])
+def test_module_imports_on_its_own(module):
+    # 每个模块都必须能单独导入，不依赖先导入 app（避免循环导入）
+    result = subprocess.run([sys.executable, '-c', f'import {module}'], cwd=ROOT, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
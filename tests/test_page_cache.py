@@ -0,0 +1,41 @@
+import sqlite3
+
+from conftest import DATABASE_FILE, watchlist
+
+
+def _write_from_another_process(sql):
+    # 另一个 worker 的写入：改数据并递增版本号，本进程的 on_commit 回调不会被调用
+    connection = sqlite3.connect(DATABASE_FILE)
+    with connection:
+        connection.execute(sql)
+        connection.execute("UPDATE table_version SET version = version + 1 WHERE name = 'movie'")
+    connection.close()
+
+
+def test_page_cache_sees_writes_from_other_processes(forged):
+    client = forged.test_client()
+    first = client.get('/')
+    assert '战狼2' in first.get_data(as_text=True)
+    assert client.get('/').get_data() == first.get_data()  # 命中页面缓存
+
+    _write_from_another_process("UPDATE movie SET title = '战狼3' WHERE id = 1001")
+    second = client.get('/', headers={'If-None-Match': first.headers['ETag']})
+    assert second.status_code == 200
+    assert second.headers['ETag'] != first.headers['ETag']
+    assert '战狼3' in second.get_data(as_text=True)
+    assert client.get('/', headers={'If-None-Match': second.headers['ETag']}).status_code == 304
+
+
+def test_page_cache_survives_unrelated_local_writes(forged):
+    client = forged.test_client()
+    assert '吴京' in client.get('/actor').get_data(as_text=True)
+    # 本进程提交 box 的改动：版本号变了，但演员页不依赖 box，缓存应继续命中
+    box = watchlist.db.session.get(watchlist.Box, 1001)
+    box.box2 = 1.0
+    watchlist.db.session.commit()
+    # 不递增版本号地改库，只有命中缓存时页面上才仍是旧名字
+    connection = sqlite3.connect(DATABASE_FILE)
+    with connection:
+        connection.execute("UPDATE actor SET name = '吴小京' WHERE id = 2001")
+    connection.close()
+    assert '吴京' in client.get('/actor').get_data(as_text=True)
@@ -0,0 +1,41 @@
+import re
+from datetime import date
+
+from conftest import watchlist
+from models import parse_release_date
+
+
+def _queries(response):
+    return int(re.search(r'desc="(\d+) queries"', response.headers['Server-Timing']).group(1))
+
+
+def test_release_date_filters(forged):
+    client = forged.test_client()
+    response = client.get('/api/v1/movies?from=2019&to=2019-02')
+    assert response.status_code == 200
+    assert 1003 in [movie['id'] for movie in response.get_json()['items']]
+    for value in ('20190101', '2019-13', '2019/2/30', 'abc', '上映 2019'):
+        assert client.get('/api/v1/movies', query_string={'from': value}).status_code == 400, value
+
+
+def test_release_date_range_is_cached(forged):
+    metrics = forged.config['METRICS']
+    forged.config['METRICS'] = True
+    try:
+        client = forged.test_client()
+        first = _queries(client.get('/api/v1/movies?from=2019-01&to=2019-06'))
+        second = _queries(client.get('/api/v1/movies?from=2019-02&to=2019-07'))
+        assert second == first - 2  # min / max 只在第一次查询
+        # 改了电影之后 movie 表的版本号变化，重新计算
+        movie = watchlist.db.session.get(watchlist.Movie, 1003)
+        movie.year = '2019/2/6'
+        watchlist.db.session.commit()
+        assert _queries(client.get('/api/v1/movies?from=2019-02&to=2019-07')) == first
+    finally:
+        forged.config['METRICS'] = metrics
+
+
+def test_parse_release_date():
+    assert parse_release_date('2020年8月21日') == (date(2020, 8, 21), 2020)
+    assert parse_release_date('2019/2/30') == (None, 2019)
+    assert parse_release_date('20190101') == (None, None)
@@ -0,0 +1,15 @@
+from conftest import watchlist
+from suggest import SuggestSnapshot
+
+
+def test_apply_does_not_disturb_running_queries(forged):
+    with watchlist.db.engine.connect() as connection:
+        snapshot = SuggestSnapshot(connection)
+    snapshot.apply(watchlist.db.session, {'movie': {1001}})
+    # 查询线程不加锁遍历 patched；apply 同时写入时不能让遍历中途出错
+    iterator = iter(snapshot.patched['movie'].items())
+    next(iterator)
+    snapshot.apply(watchlist.db.session, {'movie': {1002, 1003, 1004}})
+    assert list(iterator) == []
+    assert [entry_id for entry_id, _ in snapshot.suggest('movie', '战狼', 10)] == [1001]
+    assert set(snapshot.patched['movie']) == {1001, 1002, 1003, 1004}
@@ -0,0 +1,81 @@
+import sqlite3
+
+from conftest import DATABASE_FILE, watchlist
+
+# 本系列改动之前（baseline）的 data.db 结构：没有外键、索引和触发器，票房存成 VARCHAR
+BASELINE_SCHEMA = '''
+CREATE TABLE user (id INTEGER NOT NULL, name VARCHAR(20), username VARCHAR(20), password_hash VARCHAR(128),
+                   PRIMARY KEY (id));
+CREATE TABLE movie (id INTEGER NOT NULL, title VARCHAR(60), year VARCHAR(20), country VARCHAR(20),
+                    type VARCHAR(10), PRIMARY KEY (id));
+CREATE TABLE actor (id INTEGER NOT NULL, name VARCHAR(60), gender VARCHAR(4), country VARCHAR(20), PRIMARY KEY (id));
+CREATE TABLE box (id INTEGER NOT NULL, box2 VARCHAR(60), PRIMARY KEY (id));
+CREATE TABLE relationship (id INTEGER NOT NULL, id1 INTEGER, id2 INTEGER, type VARCHAR(10), PRIMARY KEY (id));
+INSERT INTO user (id, name) VALUES (1, 'Admin');
+INSERT INTO movie VALUES (1001, '战狼2', '2017/7/27', '中国', '战争'), (1003, '流浪地球', '2019/2/5', '中国', '科幻');
+INSERT INTO actor VALUES (2001, '吴京', '男', '中国'), (2002, '屈楚萧', '男', '中国');
+INSERT INTO box VALUES (1001, '56.84'), (1003, '46.18亿');
+INSERT INTO relationship VALUES (1, 1001, 2001, '主演'), (2, 1003, 2001, '主演'), (3, 1003, 2002, '主演');
+'''
+
+
+def _triggers():
+    connection = sqlite3.connect(DATABASE_FILE)
+    try:
+        return {row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'")}
+    finally:
+        connection.close()
+
+
+def test_upgrade_baseline_database(app):
+    connection = sqlite3.connect(DATABASE_FILE)
+    connection.executescript(BASELINE_SCHEMA)
+    connection.close()
+
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=['upgradedb'])
+    assert result.exit_code == 0, result.output
+    assert 'Applied relationship_foreign_keys.' in result.output
+    assert 'Applied recommendation_triggers.' in result.output
+    # 再执行一次不应有任何改动
+    result = runner.invoke(args=['upgradedb'])
+    assert result.exit_code == 0, result.output
+    assert 'Applied' not in result.output
+
+    # 重建 relationship 表时删掉的触发器都要补回来，和新建的库一致
+    assert _triggers() == {
+        'movie_fts_ai', 'movie_fts_ad', 'movie_fts_au', 'actor_fts_ai', 'actor_fts_ad', 'actor_fts_au',
+        'relationship_count_ai', 'relationship_count_ad', 'relationship_count_au',
+        'recommendation_dirty_ai', 'recommendation_dirty_ad', 'recommendation_dirty_au',
+        'recommendation_dirty_movie_au', 'movie_facet_ai', 'movie_facet_ad', 'movie_facet_au'}
+
+    db = watchlist.db
+    assert db.session.execute(db.text('PRAGMA foreign_key_list(relationship)')).first() is not None
+    movie = db.session.get(watchlist.Movie, 1003)
+    assert movie.cast_count == 2 and movie.release_year == 2019
+    assert db.session.get(watchlist.Box, 1003).box2 == 46.18
+    # 升级后触发器照常工作
+    db.session.add(watchlist.Relationship(id=4, id1=1001, id2=2002, type='主演'))
+    db.session.commit()
+    assert db.session.get(watchlist.Movie, 1001).cast_count == 2
+    dirty = db.session.execute(db.select(watchlist.recommendation_dirty.c.id)).scalars().all()
+    assert 1001 in dirty
+
+
+def test_upgrade_drops_redundant_country_index(app):
+    runner = app.test_cli_runner()
+    assert runner.invoke(args=['initdb']).exit_code == 0
+    connection = sqlite3.connect(DATABASE_FILE)
+    connection.execute('CREATE INDEX ix_movie_country ON movie (country)')
+    connection.commit()
+    connection.close()
+    result = runner.invoke(args=['upgradedb'])
+    assert result.exit_code == 0, result.output
+    assert 'Applied movie_facets.' in result.output
+    connection = sqlite3.connect(DATABASE_FILE)
+    try:
+        indexes = {row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    finally:
+        connection.close()
+    assert 'ix_movie_country' not in indexes and 'ix_movie_country_type_id' in indexes
+    assert 'Applied' not in runner.invoke(args=['upgradedb']).output